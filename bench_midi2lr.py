@@ -0,0 +1,272 @@
+###############################################################################
+#
+# Benchmarks for build_midi2lr_files.py.
+#
+# Times each build phase separately: XML emission, cheat image rendering and
+# PNG encoding per profile, plus complete builds. Runs on the built-in
+# profiles and on a synthetic set of generated profiles.
+#
+#   python bench_midi2lr.py [--synthetic N] [--repeat N] [-o bench.json]
+#
+# The same phases can be run through pytest-benchmark:
+#
+#   pytest bench_midi2lr.py --benchmark-only
+#
+###############################################################################
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import build_midi2lr_files as gen
+
+
+###############################################################################
+#
+# Profile sets
+#
+###############################################################################
+
+# Generate count profiles that look like the built-in ones: the knobs,
+# buttons and navigation of a randomly picked built-in profile with shuffled
+# commands, labels and colors. The result only depends on count and seed.
+#
+def make_synthetic_profiles (count, seed=0):
+    rnd = random.Random(seed)
+    commands = sorted(set(k.command for p in gen.kProfiles for k in p.knobs))
+    labels = sorted(set(k.label for p in gen.kProfiles for k in p.knobs if k.label != ""))
+
+    profiles = []
+    for n in range(count):
+        base = rnd.choice(gen.kProfiles)
+        knobs = []
+        for knob in base.knobs:
+            color = knob.color
+            if (color != None):
+                color = (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))
+            label = rnd.choice(labels) if knob.label != "" else ""
+            knobs.append(gen.Knob(knob.index, rnd.choice(commands), label, color, knob.layers))
+
+        profiles.append(gen.Profile("Synthetic-%04d" % (n+1), base.nav, knobs, base.buttons, base.groups))
+    return profiles
+
+def profile_sets (syntheticCount):
+    sets = {"builtin": gen.kProfiles}
+    if (syntheticCount > 0):
+        sets["synthetic"] = make_synthetic_profiles(syntheticCount)
+    return sets
+
+
+###############################################################################
+#
+# Phases
+#
+###############################################################################
+
+def bench_xml (profile, options):
+    outFile = io.StringIO()
+    gen.write_profile_xml(profile, outFile, options.addresses)
+    return outFile.getvalue()
+
+# Render a cheat image without encoding it, the way write_profile does: the
+# shared navigation fragments and the recorded layout of the profile, replayed
+# onto the template with the navigation drawn in. Returns the open painter and
+# the image so the result can be fed to bench_encode.
+#
+def bench_render (profile):
+    sheets    = gen.cheat_sheets(profile)
+    fragments = gen.profile_nav_fragments(profile)
+    pictures  = gen.layout_profile_layers(profile, sheets)
+    name, layers = sheets[0]
+    img = gen.init_cheat_sheet_image(fragments, layers)
+    p   = gen.init_cheat_painting(img)
+    gen.draw_cheat_sheet(p, pictures, layers)
+    return p, img
+
+def bench_encode (p, img, fileName):
+    gen.write_cheat_image(p, img, fileName)
+
+def bench_build (profiles, options, numJobs):
+    gen.build_profiles(profiles, options, numJobs, force=True)
+
+# Call func repeat times and return the timings in seconds.
+#
+def time_calls (func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-start)
+    return times
+
+def summarize (times):
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "runs": len(times),
+    }
+
+# Time XML emission, rendering and PNG encoding of each profile.
+#
+def run_profile_phases (profiles, options, repeat, tmpDir):
+    phases = {"xml": {}, "render": {}, "encode": {}}
+
+    for profile in profiles:
+        phases["xml"][profile.name] = summarize(time_calls(lambda: bench_xml(profile, options), repeat))
+        if (options.xmlOnly):
+            continue
+
+        renderTimes = []
+        encodeTimes = []
+        fileName = os.path.join(tmpDir, profile.name+".png")
+        for i in range(repeat):
+            start = time.perf_counter()
+            p, img = bench_render(profile)
+            renderTimes.append(time.perf_counter()-start)
+
+            start = time.perf_counter()
+            bench_encode(p, img, fileName)
+            encodeTimes.append(time.perf_counter()-start)
+
+        phases["render"][profile.name] = summarize(renderTimes)
+        phases["encode"][profile.name] = summarize(encodeTimes)
+
+    if (options.xmlOnly):
+        del phases["render"]
+        del phases["encode"]
+    return phases
+
+# Time complete builds (cache disabled) serially and with numJobs workers.
+#
+def run_builds (profiles, options, repeat, numJobs, tmpDir):
+    builds = {}
+    cwd = os.getcwd()
+    os.chdir(tmpDir)
+    try:
+        for jobs in sorted(set([1, numJobs])):
+            builds["jobs-"+str(jobs)] = summarize(time_calls(lambda: bench_build(profiles, options, jobs), repeat))
+    finally:
+        os.chdir(cwd)
+    return builds
+
+def git_commit ():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks (syntheticCount, repeat, numJobs, xmlOnly):
+    options = gen.BuildOptions(xmlOnly=xmlOnly)
+    if (not xmlOnly):
+        # Register the font before changing into the temporary directory.
+        gen.kFontFile = os.path.abspath(gen.kFontFile)
+        gen.init_qt()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "sets": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for name, profiles in profile_sets(syntheticCount).items():
+            results["sets"][name] = {
+                "profiles": len(profiles),
+                "phases": run_profile_phases(profiles, options, repeat, tmpDir),
+                "builds": run_builds(profiles, options, repeat, numJobs, tmpDir),
+            }
+
+    return results
+
+def print_summary (results):
+    for name, res in results["sets"].items():
+        print(name+" ("+str(res["profiles"])+" profiles)")
+        for phase, timings in res["phases"].items():
+            total = sum(t["median"] for t in timings.values())
+            print("  %-16s %9.2f ms total, %8.3f ms per profile" % (phase, total*1000, total*1000/len(timings)))
+        for build, t in res["builds"].items():
+            print("  %-16s %9.2f ms" % ("build "+build, t["median"]*1000))
+
+
+###############################################################################
+#
+# pytest-benchmark entry points
+#
+###############################################################################
+
+def test_bench_xml (benchmark):
+    options = gen.BuildOptions()
+    benchmark(lambda: [bench_xml(p, options) for p in gen.kProfiles])
+
+def test_bench_render (benchmark):
+    gen.init_qt()
+    def render_all ():
+        for profile in gen.kProfiles:
+            p, img = bench_render(profile)
+            p.end()
+    benchmark(render_all)
+
+def test_bench_encode (benchmark, tmp_path):
+    gen.init_qt()
+    def render_encode ():
+        p, img = bench_render(gen.kProfiles[0])
+        return (p, img, str(tmp_path / "bench.png")), {}
+    benchmark.pedantic(bench_encode, setup=render_encode, rounds=20)
+
+def test_bench_build (benchmark, tmp_path, monkeypatch):
+    gen.init_qt()
+    monkeypatch.chdir(tmp_path)
+    benchmark(lambda: bench_build(gen.kProfiles, gen.BuildOptions(), 1))
+
+def test_bench_build_synthetic (benchmark, tmp_path, monkeypatch):
+    gen.init_qt()
+    profiles = make_synthetic_profiles(200)
+    monkeypatch.chdir(tmp_path)
+    benchmark.pedantic(lambda: bench_build(profiles, gen.BuildOptions(), os.cpu_count() or 1), rounds=3)
+
+
+###############################################################################
+#
+# Main
+#
+###############################################################################
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark MIDI2LR profile generation.")
+    parser.add_argument("-s", "--synthetic", type=int, default=300,
+                        help="number of generated profiles for the synthetic set (default: 300, 0 disables it)")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="runs per measurement, the median is reported (default: 5)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for the parallel build (default: number of CPUs)")
+    parser.add_argument("-x", "--xml-only", action="store_true",
+                        help="benchmark XML emission only, without Qt")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write the results as JSON to FILE")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.synthetic, args.repeat, args.jobs, args.xml_only)
+    print_summary(results)
+
+    if (args.output != None):
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+            f.write("\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
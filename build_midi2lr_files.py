@@ -1,7 +1,27 @@
-from PyQt5.Qt import (
-    QApplication, QImage, QImageWriter, Qt, QFont, QFontDatabase, QPainter, QPainterPath, QPoint, QTextLayout, QTextOption,
-    QTextCharFormat, QColor, QRect, QRectF, QPen, QBrush, QTransform, QPolygon
-)
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+import string
+import sys
+import time
+import types
+
+import midi2lr_commands
+
+# PyQt5 is only needed for the cheat images. It is imported by import_qt() on
+# first use, so that XML-only builds start fast and run without Qt.
+#
+def import_qt ():
+    global QApplication, QImage, QImageWriter, Qt, QFont, QFontDatabase, QPainter, QPainterPath, QPoint
+    global QColor, QRect, QRectF, QPen, QBrush, QPicture, QSize, QBuffer, QByteArray, QIODevice
+    from PyQt5.Qt import (
+        QApplication, QImage, QImageWriter, Qt, QFont, QFontDatabase, QPainter, QPainterPath, QPoint,
+        QColor, QRect, QRectF, QPen, QBrush, QPicture, QSize, QBuffer, QByteArray, QIODevice
+    )
 
 ###############################################################################
 #
@@ -9,962 +29,2944 @@ from PyQt5.Qt import (
 #
 kImgW = 800
 kImgH = 220
-kColorBg = QColor(50, 50, 50)
-kColorMd = QColor(90, 90, 90)
-kColorFg = QColor(200, 200, 200)
-kColorSl = QColor(200, 100, 0)
+kColorBg = (50, 50, 50)
+kColorMd = (90, 90, 90)
+kColorFg = (200, 200, 200)
+kColorSl = (200, 100, 0)
+kFontFile = "./SourceSansPro-SemiBold.ttf"
 #
 ###############################################################################
 
 
 ###############################################################################
 #
-# Functions to write knob & button settings.
+# MIDI addresses.
+#
+# The X-Touch Mini in standard mode sends everything on one global channel.
+# Each layer has its own controller numbers for the 8 knobs and its own note
+# numbers for the knob pushes and the 2 rows of 8 buttons. The address table
+# maps (layer, control, row, index) to (channel, number) and is the only
+# place these numbers are defined. Knobs and knob pushes use row 0.
 #
 ###############################################################################
 
-def write_header (outFile):
-    print("<?xml version=\"1.0\" encoding=\"UTF-8\"?>", file=outFile)
-    print("\n<!-- Generated MIDI2LR Profile for Behringer X-Touch Mini -->\n", file=outFile)
-    print("<settings>", file=outFile)
+kKnob     = "knob"      # controller number
+kKnobPush = "push"      # note number
+kButton   = "button"    # note number
 
-def write_footer (outFile):
-    print("</settings>", file=outFile)
+kDefaultChannel = 11
 
-# Write a single knob control definition. Two lines are written:
-#  - A controller setting for the knob turning action
-#  - A note setting for the knob push action to reset the parameter
-#
-def write_knob_setting (controllerNumber, noteNumber, commandString, outFile):
-    print("    <setting channel=\"11\" controller=\""+str(controllerNumber)+"\" command_string=\""+commandString+"\"/>", file=outFile)
-    print("    <setting channel=\"11\" note=\""+str(noteNumber)+"\" command_string=\"Reset"+commandString+"\"/>", file=outFile)
+# First controller/note number minus one of each layer, per control row.
+kStandardLayout = {
+    "A": {(kKnob, 0): 0,  (kKnobPush, 0): -1, (kButton, 1): 7,  (kButton, 2): 15},
+    "B": {(kKnob, 0): 10, (kKnobPush, 0): 23, (kButton, 1): 31, (kButton, 2): 39},
+}
 
-# Write a knob definition for layer A.
-# controllerIndex   The controller postion (1-8)
+# Build a read-only address table for the given global channel and layout.
+#
+def build_address_map (channel=kDefaultChannel, layout=kStandardLayout, count=8):
+    addresses = {}
+    for layer, rows in layout.items():
+        for (control, row), offset in rows.items():
+            for index in range(1, count+1):
+                addresses[(layer, control, row, index)] = (channel, index+offset)
+    return types.MappingProxyType(addresses)
+
+kAddressMap = build_address_map()
+
+# A MIDI controller the profiles are built for.
+# name      Short name, used as the output directory in device builds
+# title     Name in the XML profile header
+# channel   The default global MIDI channel
+# columns   The number of knobs and of buttons per row
+# rows      The number of button rows
+# layout    First controller/note number minus one of each layer, per
+#           control row (see kStandardLayout)
+# width, height   The cheat image size
 #
-def write_knob_a (controllerIndex, commandString, label, p, outFile, color=None):
-    write_knob_setting(controllerIndex, controllerIndex-1, commandString, outFile)
-    draw_cheat_knob(p, controllerIndex, label, color)
+class Device:
+    __slots__ = ("name", "title", "channel", "columns", "rows", "layout", "width", "height")
+
+    def __init__ (self, name, title, channel, columns, rows, layout, width, height):
+        self.name    = name
+        self.title   = title
+        self.channel = channel
+        self.columns = columns
+        self.rows    = rows
+        self.layout  = layout
+        self.width   = width
+        self.height  = height
+
+    def address_map (self, channel=None):
+        return build_address_map(channel or self.channel, self.layout, self.columns)
+
+    # In a descriptor file the layout rows are named "knob", "push" and
+    # "buttonN" for button row N.
+    #
+    def to_dict (self):
+        layout = {}
+        for layer, rows in self.layout.items():
+            layout[layer] = {(control if control != kButton else control+str(row)): offset
+                             for (control, row), offset in rows.items()}
+        return {"name": self.name, "title": self.title, "channel": self.channel, "columns": self.columns,
+                "rows": self.rows, "layout": layout, "image": {"width": self.width, "height": self.height}}
+
+    @classmethod
+    def from_dict (cls, d):
+        layout = {}
+        for layer, rows in d["layout"].items():
+            layout[layer] = {}
+            for key, offset in rows.items():
+                if (key in (kKnob, kKnobPush)):
+                    layout[layer][(key, 0)] = offset
+                elif (key.startswith(kButton) and key[len(kButton):].isdigit()):
+                    layout[layer][(kButton, int(key[len(kButton):]))] = offset
+                else:
+                    raise ValueError("Device "+d["name"]+": unknown control row "+key)
+        image = d.get("image", {})
+        return cls(d["name"], d.get("title", d["name"]), d.get("channel", kDefaultChannel), d.get("columns", 8),
+                   d.get("rows", 2), layout, image.get("width", kImgW), image.get("height", kImgH))
+
+def load_device (fileName):
+    with open(fileName) as f:
+        return Device.from_dict(json.load(f))
+
+kDeviceXTouchMini = Device("xtouch-mini", "Behringer X-Touch Mini", kDefaultChannel, 8, 2, kStandardLayout,
+                           kImgW, kImgH)
 
 
-# Write a knob definition for layer B.
-# controllerIndex   The controller postion (1-8)
+###############################################################################
 #
-def write_knob_b (controllerIndex, commandString, outFile):
-    write_knob_setting(controllerIndex+10, controllerIndex+23, commandString, outFile)
-
-# Write a knob definition for both layers A and B.
-# controllerIndex   The controller postion (1-8)
+# Functions to write knob & button settings.
 #
-def write_knob_ab (controllerIndex, commandString, outFile):
-    write_knob_a(controllerIndex, commandString, outFile)
-    write_knob_b(controllerIndex, commandString, outFile)
-
 ###############################################################################
 
-# Write a single button control definition.
-# noteNumber    The midi note number to assign the command to.
+# XML templates. A profile is assembled from these in memory and written to
+# its file in one go, see write_profile().
 #
-def write_button_setting (noteNumber, commandString, outFile):
-    print("    <setting channel=\"11\" note=\""+str(noteNumber)+"\" command_string=\""+commandString+"\"/>", file=outFile)
+kXmlHeader = (
+    "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+    "\n<!-- Generated MIDI2LR Profile for %s -->\n\n"
+    "<settings>\n"
+)
+kXmlFooter            = "</settings>\n"
+kXmlComment           = "\n    <!-- %s -->\n\n"
+kXmlSettingController = "    <setting channel=\"%d\" controller=\"%d\" command_string=\"%s\"/>\n"
+kXmlSettingNote       = "    <setting channel=\"%d\" note=\"%d\" command_string=\"%s\"/>\n"
+kXmlSetup             = "    <setup channel=\"%d\" note=\"%d\" value=\"%d\"/>\n"
 
-# Write a single button definition for the upper button row in the A layer.
-# buttonIndex   The button position (1-8)
-#
-def write_button_upper_a(buttonIndex, commandString, label, p, outFile):
-    write_button_setting(buttonIndex+7, commandString, outFile)
-    draw_cheat_button(p, 1, buttonIndex, label)
+def write_header (outFile, title=kDeviceXTouchMini.title):
+    outFile.write(kXmlHeader % title)
 
-# Write a single button definition for the upper button row in the B layer.
-# buttonIndex   The button position (1-8)
-#
-def write_button_upper_b(buttonIndex, commandString, outFile):
-    write_button_setting(buttonIndex+31, commandString, outFile)
+def write_footer (outFile):
+    outFile.write(kXmlFooter)
+
+def write_comment (text, outFile):
+    outFile.write(kXmlComment % text)
 
-# Write a setting definition that assigns the same command to the same button
-# in the upper button row for both A and B layers.
-# buttonIndex   The button position (1-8)
+# Write a single knob control definition. Two lines are written:
+#  - A controller setting for the knob turning action
+#  - A note setting for the knob push action to reset the parameter, unless
+#    pushAddress is None
+# address, pushAddress   The (channel, number) of the knob and its push action
 #
-def write_button_upper_ab(buttonIndex, commandString, label, p, outFile):
-    write_button_upper_a(buttonIndex, commandString, label, p, outFile)
-    write_button_upper_b(buttonIndex, commandString, outFile)
-    # print("", file=outFile)
+def write_knob_setting (address, pushAddress, commandString, outFile):
+    outFile.write(kXmlSettingController % (address[0], address[1], commandString))
+    if (pushAddress != None):
+        outFile.write(kXmlSettingNote % (pushAddress[0], pushAddress[1], "Reset"+commandString))
 
-# Write a single button definition for the upper lower row in the A layer.
-# buttonIndex   The button position (1-8)
+# Write a single button control definition.
+# address   The (channel, note) to assign the command to.
 #
-def write_button_lower_a(buttonIndex, commandString, label, p, outFile):
-    write_button_setting(buttonIndex+15, commandString, outFile)
-    draw_cheat_button(p, 2, buttonIndex, label)
+def write_button_setting (address, commandString, outFile):
+    outFile.write(kXmlSettingNote % (address[0], address[1], commandString))
 
-# Write a single button definition for the lower button row in the B layer.
-# buttonIndex   The button position (1-8)
+# Write a single button setup definition.
+# address   The (channel, note) of the button LED.
+# value     The note value (0 - dark, 1 - lit)
 #
-def write_button_lower_b(buttonIndex, commandString, outFile):
-    write_button_setting(buttonIndex+39, commandString, outFile)
+def write_button_setup (address, value, outFile):
+    outFile.write(kXmlSetup % (address[0], address[1], value))
 
-# Write a setting definition that assigns the same command to the same button
-# in the lower button row for both A and B layers.
-# buttonIndex   The button position (1-8)
+# Write a knob definition for one layer. The knob push is left unassigned for
+# commands that cannot be reset. Knobs and layers the device doesn't have
+# (no address) are left out, here and for buttons.
+# index     The controller postion (1-8)
+#
+def write_knob (layer, index, commandString, outFile, addresses=None):
+    addresses = addresses or kAddressMap
+    address = addresses.get((layer, kKnob, 0, index))
+    if (address == None):
+        return
+    pushAddress = None
+    if (midi2lr_commands.is_resettable(commandString)):
+        pushAddress = addresses.get((layer, kKnobPush, 0, index))
+    write_knob_setting(address, pushAddress, commandString, outFile)
+
+# Write a button definition for each of the given layers.
+# row       The button row (1 - upper, 2 - lower)
+# index     The button position (1-8)
 #
-def write_button_lower_ab (buttonIndex, commandString, label, p, outFile):
-    write_button_lower_a(buttonIndex, commandString, label, p, outFile)
-    write_button_lower_b(buttonIndex, commandString, outFile)
-    # print("", file=outFile)
+def write_button_layers (layers, row, index, commandString, outFile, addresses=None):
+    addresses = addresses or kAddressMap
+    for layer in layers:
+        address = addresses.get((layer, kButton, row, index))
+        if (address != None):
+            write_button_setting(address, commandString, outFile)
+
+# Write a button setup definition for each of the given layers.
+#
+def write_button_setup_layers (layers, row, index, value, outFile, addresses=None):
+    addresses = addresses or kAddressMap
+    for layer in layers:
+        address = addresses.get((layer, kButton, row, index))
+        if (address != None):
+            write_button_setup(address, value, outFile)
 
-###############################################################################
 
-# Write a single button setup definition.
-# noteNumber    The midi note number to assign the command to.
-# value         The note value (0 - dark, 1 - lit)
-#
-def write_button_setup (noteNumber, value, outFile):
-    print("    <setup channel=\"11\" note=\""+str(noteNumber)+"\" value=\""+str(value)+"\"/>", file=outFile)
 
-# Write a single button setup for the upper button row in the A layer.
-# buttonIndex   The button position (1-8)
+###############################################################################
 #
-def write_button_setup_upper_a(buttonIndex, value, outFile):
-    write_button_setup(buttonIndex+7, value, outFile)
-
-# Write a single button definition for the upper button row in the B layer.
-# buttonIndex   The button position (1-8)
+# Cheat image.
 #
-def write_button_setup_upper_b(buttonIndex, value, outFile):
-    write_button_setup(buttonIndex+31, value, outFile)
+###############################################################################
 
-# Write a setup definition that assigns the same command to the same button
-# in the upper button row for both A and B layers.
-# buttonIndex   The button position (1-8)
+# Rendering resources. Fonts, pens, brushes and button shapes are created on
+# first use and then shared by every cheat image drawn in this process.
+# renderCacheStats counts the lookups that found (hits) or had to create
+# (misses) a resource.
 #
-def write_button_setup_upper_ab(buttonIndex, value, outFile):
-    write_button_setup_upper_a(buttonIndex, value, outFile)
-    write_button_setup_upper_b(buttonIndex, value, outFile)
-    # print("", file=outFile)
+renderCache = {}
+renderCacheStats = {"hits": 0, "misses": 0}
+
+def cached_resource (key, factory):
+    res = renderCache.get(key)
+    if (res == None):
+        renderCacheStats["misses"] += 1
+        res = factory()
+        renderCache[key] = res
+    else:
+        renderCacheStats["hits"] += 1
+    return res
+
+def cheat_font (size):
+    return cached_resource(("font", size), lambda: QFont("Source Sans Pro", size, QFont.DemiBold))
 
-# Write a single button setup for the upper lower row in the A layer.
-# buttonIndex   The button position (1-8)
+# Colors are (r, g, b) tuples until they are used for drawing.
 #
-def write_button_setup_lower_a(buttonIndex, value, outFile):
-    write_button_setup(buttonIndex+15, value, outFile)
+def cheat_color (color):
+    return cached_resource(("color", color), lambda: QColor(*color))
 
-# Write a single button setup for the lower button row in the B layer.
-# buttonIndex   The button position (1-8)
+# A pen of the given color, with the given width or the QPen default width.
+#
+def cheat_pen (color, width=None):
+    if (width == None):
+        return cached_resource(("pen", color), lambda: QPen(cheat_color(color)))
+    return cached_resource(("pen", color, width), lambda: QPen(cheat_color(color), width))
+
+def cheat_brush (color):
+    return cached_resource(("brush", color), lambda: QBrush(cheat_color(color)))
+
+# The cheat image layout of a device: the image size and the position of
+# every knob and button. The image has a column per knob; the knobs take the
+# upper 40 percent, the button rows share the rest.
+# key       Identifies the layout in the render caches
+# knobs     By column: the knob center (x, y) and inner ring radius
+# buttons   By (row, column): see cheat_button_geometry
+#
+class CheatLayout:
+    __slots__ = ("key", "width", "height", "columns", "rows", "knobs", "buttons")
+
+    def __init__ (self, device):
+        self.key     = (device.width, device.height, device.columns, device.rows)
+        self.width   = device.width
+        self.height  = device.height
+        self.columns = device.columns
+        self.rows    = device.rows
+
+        bxWidth  = self.width/self.columns
+        bxOff    = self.height*0.4
+        bxHeight = (self.height-bxOff)/self.rows
+
+        self.knobs = {}
+        for col in range(1, self.columns+1):
+            self.knobs[col] = (int(bxWidth*col-bxWidth/2), int(bxOff*0.35), bxOff*0.12)
+
+        self.buttons = {}
+        btWidth  = bxWidth*0.35
+        btHeight = bxHeight*0.4
+        for row in range(1, self.rows+1):
+            for col in range(1, self.columns+1):
+                btX = bxWidth*col-bxWidth/2-btWidth/2
+                btY = bxOff+bxHeight*row-bxHeight/2-btHeight/2-bxHeight*0.15
+                self.buttons[(row, col)] = (bxWidth, bxHeight, btX, btY, btWidth, btHeight)
+
+cheatLayouts = {}
+
+# The layout of device, computed once per process.
+#
+def cheat_layout (device):
+    key = (device.width, device.height, device.columns, device.rows)
+    layout = cheatLayouts.get(key)
+    if (layout == None):
+        layout = CheatLayout(device)
+        cheatLayouts[key] = layout
+    return layout
+
+# The layout cheat images are currently drawn in, see use_device.
+cheatLayout = cheat_layout(kDeviceXTouchMini)
+
+# Draw the cheat images of device from now on.
 #
-def write_button_setup_lower_b(buttonIndex, value, outFile):
-    write_button_setup(buttonIndex+39, value, outFile)
+def use_device (device):
+    global cheatLayout
+    cheatLayout = cheat_layout(device)
+
+# The template holds everything that is the same in every cheat image: the
+# background, the numbered channel circles, the knob rings and the empty
+# button outlines. It is rendered once per process, layout and scale; each
+# cheat image starts as a copy of it and only the profile specific parts are
+# painted on top.
+#
+def draw_cheat_template (p):
+    p.fillRect(QRect(0, 0, cheatLayout.width, cheatLayout.height), cheat_color(kColorBg))
+
+    for col in range(1, cheatLayout.columns+1):
+        draw_cheat_knob_base(p, col)
+    for row in range(1, cheatLayout.rows+1):
+        for col in range(1, cheatLayout.columns+1):
+            draw_cheat_button_outline(p, row, col, 1)
+
+def cheat_image_size (scale):
+    return int(round(cheatLayout.width*scale)), int(round(cheatLayout.height*scale))
+
+def make_cheat_template (scale=1):
+    img = QImage(*cheat_image_size(scale), QImage.Format_ARGB32)
+    p = init_cheat_painting(img, scale)
+    draw_cheat_template(p)
+    p.end()
+    return img
 
-# Write a setup definition that assigns the same command to the same button
-# in the lower button row for both A and B layers.
-# buttonIndex   The button position (1-8)
+# The shared template; copy it before painting on it.
 #
-def write_button_setup_lower_ab (buttonIndex, value, outFile):
-    write_button_setup_lower_a(buttonIndex, value, outFile)
-    write_button_setup_lower_b(buttonIndex, value, outFile)
-    # print("", file=outFile)
+def cheat_template (scale=1):
+    return cached_resource(("template", cheatLayout.key, scale), lambda: make_cheat_template(scale))
 
+def init_cheat_image (scale=1):
+    return cheat_template(scale).copy()
 
-###############################################################################
-#
-# Cheat image.
+# The starting image of a sheet showing layers stacked top to bottom: the
+# template with the navigation of fragments (see nav_base_image) per layer.
 #
-###############################################################################
+def init_cheat_sheet_image (fragments, layers, scale=1):
+    bases = [nav_base_image(fragments, layer, scale) for layer in layers]
+    if (len(bases) == 1):
+        return bases[0].copy()
 
-def init_cheat_image ():
-    return QImage(kImgW, kImgH, QImage.Format_ARGB32)
+    img = QImage(bases[0].width(), bases[0].height()*len(bases), QImage.Format_ARGB32)
+    p = QPainter(img)
+    for n, base in enumerate(bases):
+        p.drawImage(0, base.height()*n, base)
+    p.end()
+    return img
 
-def init_cheat_painting (img):
+# A painter on img that draws in the coordinates of the layout,
+# scaled by scale.
+#
+def init_cheat_painting (img, scale=1):
     p = QPainter(img)
     p.setRenderHint(QPainter.Antialiasing)
-
-    rect = QRect(0, 0, img.width(), img.height())
-
-    p.fillRect(rect, kColorBg)
+    if (scale != 1):
+        p.scale(scale, scale)
 
     return p
 
-def draw_cheat_knob (p, col, txt, color=None):
-    bxWidth  = kImgW/8
-    bxHeight = kImgH*0.4
+# Knob position and inner ring radius.
+#
+def cheat_knob_geometry (col):
+    x, y, r = cheatLayout.knobs[col]
+    return QPoint(x, y), r
+
+# Draw the parts of a knob that don't depend on its assignment.
+#
+def draw_cheat_knob_base (p, col):
+    bxWidth  = cheatLayout.width/cheatLayout.columns
 
     # Channel number
     r = bxWidth*0.09
-    c = QPoint(bxWidth*(col-1)+r*1.5, r*1.5)
-    p.setPen(QPen(kColorMd, 0))
-    p.setBrush(kColorMd)
+    c = QPoint(int(bxWidth*(col-1)+r*1.5), int(r*1.5))
+    p.setPen(cheat_pen(kColorMd, 0))
+    p.setBrush(cheat_brush(kColorMd))
     p.drawEllipse(c, r, r)
 
-    p.setFont(QFont("Source Sans Pro", 10, QFont.DemiBold))
-    p.setPen(kColorBg)
-    p.drawText(QRect(c.x()-r, c.y()-r, r*2, r*2), Qt.AlignHCenter, str(col))
+    p.setFont(cheat_font(10))
+    p.setPen(cheat_pen(kColorBg))
+    p.drawText(QRect(int(c.x()-r), int(c.y()-r), int(r*2), int(r*2)), Qt.AlignHCenter, str(col))
 
-    # Knob
-    if (txt != ""):
-        p.setPen(QPen(kColorMd, 3))
-    else:
-        p.setPen(QPen(kColorMd, 1))
+    # Knob rings
+    c, r = cheat_knob_geometry(col)
+    p.setPen(cheat_pen(kColorMd, 1))
     p.setBrush(Qt.NoBrush)
-
-    c = QPoint(bxWidth*col-bxWidth/2, bxHeight*0.35)
-    r = bxHeight * 0.12
     p.drawEllipse(c, r, r)
-    p.setPen(QPen(kColorMd, 1))
     p.drawEllipse(c, r*1.9, r*1.9)
 
+# Draw the assignment of a knob over its base in the template. Unassigned
+# knobs (no label) and knobs the device doesn't have are left out.
+#
+def draw_cheat_knob (p, col, txt, color=None):
+    if ((txt == "" and color == None) or col not in cheatLayout.knobs):
+        return
+
+    bxWidth  = cheatLayout.width/cheatLayout.columns
+    bxHeight = cheatLayout.height*0.4
+    c, r = cheat_knob_geometry(col)
+
+    if (txt != ""):
+        p.setPen(cheat_pen(kColorMd, 3))
+        p.setBrush(Qt.NoBrush)
+        p.drawEllipse(c, r, r)
+
     if (color != None):
-        p.setPen(QPen(kColorMd, 0))
-        p.setBrush(color)
+        p.setPen(cheat_pen(kColorMd, 0))
+        p.setBrush(cheat_brush(color))
         p.drawEllipse(c, r, r)
         p.setBrush(Qt.NoBrush)
 
-    p.setFont(QFont("Source Sans Pro", 11, QFont.DemiBold))
-    p.setPen(kColorFg)
-    p.drawText(QRect(bxWidth*(col-1), bxHeight*0.6, bxWidth, bxHeight*0.3), Qt.AlignHCenter, txt.upper())
+    p.setFont(cheat_font(11))
+    p.setPen(cheat_pen(kColorFg))
+    p.drawText(QRect(int(bxWidth*(col-1)), int(bxHeight*0.6), int(bxWidth), int(bxHeight*0.3)), Qt.AlignHCenter, txt.upper())
 
 
-def draw_cheat_button (p, row, col, txt, isSelected=0):
-
-    bxOff    = kImgH*0.4
-    bxWidth  = kImgW/8
-    bxHeight = (kImgH-bxOff)/2
-    btWidth  = bxWidth*0.35
-    btHeight = bxHeight*0.4
-    btX = bxWidth*col-bxWidth/2-btWidth/2
-    btY = bxOff+bxHeight*row-bxHeight/2-btHeight/2-bxHeight*0.15
+# Geometry of a button: its bounding box width and height, its rounded-rect
+# position and size.
+#
+def cheat_button_geometry (row, col):
+    return cheatLayout.buttons[(row, col)]
 
+def make_cheat_button_path (row, col):
+    bxWidth, bxHeight, btX, btY, btWidth, btHeight = cheat_button_geometry(row, col)
     path = QPainterPath()
     path.addRoundedRect(QRectF(btX, btY, btWidth, btHeight), 5, 5)
+    return path
 
-    if (txt != ""):
-        p.setPen(QPen(kColorMd, 3))
-    else:
-        p.setPen(QPen(kColorMd, 1))
+def cheat_button_path (row, col):
+    return cached_resource(("button", cheatLayout.key, row, col), lambda: make_cheat_button_path(row, col))
+
+def draw_cheat_button_outline (p, row, col, width):
+    p.setPen(cheat_pen(kColorMd, width))
     p.setBrush(Qt.NoBrush)
-    p.drawPath(path)
+    p.drawPath(cheat_button_path(row, col))
+
+# Draw the assignment of a button over its empty outline in the template.
+# Buttons the device doesn't have are left out.
+#
+def draw_cheat_button (p, row, col, txt, isSelected=0):
+    if ((row, col) not in cheatLayout.buttons):
+        return
+    bxWidth, bxHeight, btX, btY, btWidth, btHeight = cheat_button_geometry(row, col)
+
+    if (txt != ""):
+        draw_cheat_button_outline(p, row, col, 3)
 
-    p.setFont(QFont("Source Sans Pro", 11, QFont.DemiBold))
-    p.setPen(kColorFg)
-    p.drawText(QRect(bxWidth*(col-1), btY+btHeight*1.2, bxWidth, bxHeight*0.3), Qt.AlignHCenter, txt.upper())
+        p.setFont(cheat_font(11))
+        p.setPen(cheat_pen(kColorFg))
+        p.drawText(QRect(int(bxWidth*(col-1)), int(btY+btHeight*1.2), int(bxWidth), int(bxHeight*0.3)), Qt.AlignHCenter, txt.upper())
 
     if (isSelected):
-        p.setPen(QPen(kColorMd, 3))
-        p.setBrush(QBrush(kColorSl))
-        p.drawPath(path)
+        p.setPen(cheat_pen(kColorMd, 3))
+        p.setBrush(cheat_brush(kColorSl))
+        p.drawPath(cheat_button_path(row, col))
 
     #p.drawRect(bxWidth*(col-1), bxOff+bxHeight*(row-1), bxWidth, bxHeight)
 
+# Draw a bracket below knobs colA to colB, clipped to the knobs of the device.
+#
 def draw_cheat_knob_group (p, colA, colB, txt):
+    if (colA > cheatLayout.columns):
+        return
+    colB  = min(colB, cheatLayout.columns)
     rArc  = 12
-    posY  = kImgH*0.34
-    posXA = kImgW/8*(colA-1)+4
-    posXB = kImgW/8*(colB)-4
+    posY  = cheatLayout.height*0.34
+    posXA = cheatLayout.width/cheatLayout.columns*(colA-1)+4
+    posXB = cheatLayout.width/cheatLayout.columns*(colB)-4
     len   = posXB-posXA
 
-    p.setPen(QPen(kColorMd, 2))
-    p.drawLine(posXA+rArc-4, posY, posXB-rArc+4, posY)
-    p.drawArc(posXA, posY-rArc, rArc, rArc, 180*16, 90*16)
-    p.drawArc(posXB-rArc, posY-rArc, rArc, rArc, 270*16, 90*16)
-
-    p.drawText(QRect(posXA, posY+1, len, 16), Qt.AlignHCenter, txt.upper())
-
-
-def write_cheat_image (p, img, fileName):
-    p.end()
+    p.setPen(cheat_pen(kColorMd, 2))
+    p.drawLine(int(posXA+rArc-4), int(posY), int(posXB-rArc+4), int(posY))
+    p.drawArc(int(posXA), int(posY-rArc), rArc, rArc, 180*16, 90*16)
+    p.drawArc(int(posXB-rArc), int(posY-rArc), rArc, rArc, 270*16, 90*16)
 
-    writer = QImageWriter(fileName)
-    writer.write(img)
+    p.drawText(QRect(int(posXA), int(posY+1), int(len), 16), Qt.AlignHCenter, txt.upper())
 
 
-###############################################################################
+# How cheat images are encoded.
+# format    "png" or "webp"
+# palette   Write PNGs as 8-bit palette images where the image has at most
+#           256 colors, so that the palette is exact; others (e.g. with
+#           antialiased colored knobs) stay truecolor
+# level     PNG compression level 0-9, or None for Qt's default
+# quality   WebP quality 0-99 for lossy WebP, or None for lossless WebP
+# optimize  Encode PNGs with and without an exact palette at level 9 and keep
+#           the smaller one
 #
-# Global assignment blocks (navigation).
-#
-###############################################################################
+class ImageEncoding:
+    __slots__ = ("format", "palette", "level", "quality", "optimize")
 
-def write_global_nav_setup (activeItem, outFile):
-    print ("\n    <!-- Global Navigation Setup -->\n", file=outFile)
-    
-    for index in range (1, 8):
-        value = 0
-        if (index == activeItem):
-            value = 1
+    def __init__ (self, format="png", palette=False, level=None, quality=None, optimize=False):
+        self.format   = format
+        self.palette  = palette
+        self.level    = level
+        self.quality  = quality
+        self.optimize = optimize
 
-        write_button_setup_lower_ab(index, value, outFile)
+    def extension (self):
+        return "."+self.format
 
-def write_submenu_setup (activeItem, outFile):
-    print ("\n    <!-- Submenu Navigation Setup -->\n", file=outFile)
-    
-    for index in range (1, 6):
-        value = 0
-        if (index == activeItem):
-            value = 1
+    def to_dict (self):
+        return {"format": self.format, "palette": self.palette, "level": self.level,
+                "quality": self.quality, "optimize": self.optimize}
 
-        write_button_setup_upper_ab(index, value, outFile)
+    @classmethod
+    def from_dict (cls, d):
+        return cls(d.get("format", "png"), d.get("palette", False), d.get("level"),
+                   d.get("quality"), d.get("optimize", False))
 
-# Submenu in upper key row for Basic mode
+kImageFormats = ("png", "webp")
+
+# Convert an image to 8-bit palette colors, every color with its own palette
+# entry. Returns None if the image has more than 256 colors.
 #
-def write_nav_basic (sel, p, outFile):
-    print ("\n    <!-- Basic Profile Sub-Navigation -->\n", file=outFile)
-    write_button_upper_ab(1, "RevealPanelLens", "Lens", p, outFile)
-    write_button_upper_ab(2, "ActionSeries4", "Transform", p, outFile)
-    write_button_upper_ab(3, "CropOverlay", "Crop", p, outFile)
-    draw_cheat_button(p, 1, 4, "")
-    draw_cheat_button(p, 1, 5, "")
-    draw_cheat_button(p, 1, 6, "")
-    draw_cheat_button(p, 1, sel, "", 1)
-
-def write_nav_colors_1 (sel, p, outFile):
-    print ("\n    <!-- Colors 1 Profile Sub-Navigation -->\n", file=outFile)
-    write_button_upper_ab(1, "ActionSeries2", "Tone", p, outFile)
-    write_button_upper_ab(2, "ActionSeries3", "Presence", p, outFile)
-    write_button_upper_ab(3, "GraduatedFilter", "Gradient", p, outFile)
-    write_button_upper_ab(4, "AdjustmentBrush", "Brush", p, outFile)
-    write_button_upper_ab(5, "RevealPanelTone", "Tone Curve", p, outFile)
-    draw_cheat_button(p, 1, 6, "")
-    draw_cheat_button(p, 1, sel, "", 1)
-
-def write_nav_colors_2 (sel, p, outFile):
-    print ("\n    <!-- Colors 2 Profile Sub-Navigation -->\n", file=outFile)
-    write_button_upper_ab(1, "ActionSeries5", "Hue", p, outFile)
-    write_button_upper_ab(2, "ActionSeries6", "Saturation", p, outFile)
-    write_button_upper_ab(3, "ActionSeries7", "Luminance", p, outFile)
-    draw_cheat_button(p, 1, 4, "")
-    draw_cheat_button(p, 1, 5, "")
-    draw_cheat_button(p, 1, 6, "")
-    draw_cheat_button(p, 1, sel, "", 1)
-
-def write_nav_enhance (sel, p, outFile):
-    print ("\n    <!-- Enhance Profile Sub-Navigation -->\n", file=outFile)
-    write_button_upper_ab(1, "RevealPanelEffects", "Effects", p, outFile)
-    write_button_upper_ab(2, "RevealPanelDetail", "Detail", p, outFile)
-    draw_cheat_button(p, 1, 3, "")
-    draw_cheat_button(p, 1, 4, "")
-    draw_cheat_button(p, 1, 5, "")
-    draw_cheat_button(p, 1, 6, "")
-    draw_cheat_button(p, 1, sel, "", 1)
-
-def write_nav_grading (sel, p, outFile):
-    print ("\n    <!-- Grading Profile Sub-Navigation -->\n", file=outFile)
-    write_button_upper_ab(1, "ActionSeries9", "Midtones", p, outFile)
-    write_button_upper_ab(2, "ActionSeries10", "Highlights", p, outFile)
-    write_button_upper_ab(3, "ActionSeries11", "Shadows", p, outFile)
-    write_button_upper_ab(4, "ActionSeries12", "Global", p, outFile)
-    draw_cheat_button(p, 1, 5, "")
-    draw_cheat_button(p, 1, 6, "")
-    draw_cheat_button(p, 1, sel, "", 1)
-
-
-def write_global_nav_keys (sel, p, outFile):
-    print ("\n    <!-- Global Navigation -->\n", file=outFile)
-
-    write_button_upper_ab(7, "Key3", "Before/After", p, outFile)
-    write_button_upper_ab(8, "Key1", "Clipping", p, outFile)
-    write_button_lower_ab(1, "ActionSeries1", "Library", p, outFile)
-    write_button_lower_ab(2, "RevealPanelLens", "Basic", p, outFile)
-    write_button_lower_ab(3, "ActionSeries2", "Colours 1", p, outFile)
-    write_button_lower_ab(4, "ActionSeries5", "Colours 2", p, outFile)
-    write_button_lower_ab(5, "ActionSeries8", "Grayscale", p, outFile)
-    write_button_lower_ab(6, "RevealPanelEffects", "Enhance", p, outFile)
-    write_button_lower_ab(7, "ActionSeries9", "Grading", p, outFile)
-    write_button_lower_ab(8, "ToggleZoomOffOn", "Zoom", p, outFile)
-    draw_cheat_button(p, 2, sel, "", 1)
-
-
-
-###############################################################################
-#
-# Functions to write profile files.
+def palette_image (img):
+    img = img.convertToFormat(QImage.Format_ARGB32)
+    bits = img.constBits()
+    bits.setsize(img.sizeInBytes())
+    colors = set(memoryview(bits).cast("I"))
+    if (len(colors) > 256):
+        return None
+    return img.convertToFormat(QImage.Format_Indexed8, sorted(colors), Qt.ThresholdDither)
+
+# Encode an image with a format and a Qt writer quality. Returns the encoded
+# bytes.
 #
-###############################################################################
-
-# Library
+def encode_image (img, format, quality=-1):
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.WriteOnly)
+    writer = QImageWriter(buf, format.encode())
+    writer.setQuality(quality)
+    if (not writer.write(img)):
+        raise OSError("cannot encode "+format+" image: "+writer.errorString())
+    return bytes(data)
+
+# Qt's PNG writer takes the compression level as a quality: 100 - level 0,
+# 0 - level 9.
+#
+def png_quality (level):
+    if (level == None):
+        return -1
+    return 100-(level*91+8)//9
+
+def encode_cheat_image (img, encoding):
+    if (encoding.format == "webp"):
+        return encode_image(img, "webp", 100 if encoding.quality == None else encoding.quality)
+
+    if (encoding.optimize):
+        candidates = [encode_image(img, "png", png_quality(9))]
+        paletteImg = palette_image(img)
+        if (paletteImg != None):
+            candidates.append(encode_image(paletteImg, "png", png_quality(9)))
+        return min(candidates, key=len)
+    if (encoding.palette):
+        paletteImg = palette_image(img)
+        if (paletteImg != None):
+            img = paletteImg
+    return encode_image(img, "png", png_quality(encoding.level))
+
+# Finish painting and write the image. The default encoding is Qt's PNG
+# writer with its default settings. Returns the file size.
+#
+def write_cheat_image (p, img, fileName, encoding=None):
+    p.end()
 
-def write_profile_library ():
+    data = encode_cheat_image(img, encoding or ImageEncoding())
+    with open(fileName, "wb") as f:
+        f.write(data)
+    return len(data)
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+# Write recorded layouts (see layout_profile_image) on the template as a
+# scalable SVG image. layouts holds a list of pictures per layer, drawn on
+# templates stacked top to bottom.
+#
+def write_cheat_svg (layouts, fileName, title=""):
+    from PyQt5.QtSvg import QSvgGenerator
+
+    height = cheatLayout.height*len(layouts)
+    generator = QSvgGenerator()
+    generator.setFileName(fileName)
+    generator.setSize(QSize(cheatLayout.width, height))
+    generator.setViewBox(QRect(0, 0, cheatLayout.width, height))
+    generator.setTitle(title)
+    # Match the resolution of the PNGs, so that font point sizes are the same.
+    generator.setResolution(QImage(1, 1, QImage.Format_ARGB32).logicalDpiX())
+
+    p = init_cheat_painting(generator)
+    for n, pictures in enumerate(layouts):
+        p.save()
+        p.translate(0, cheatLayout.height*n)
+        draw_cheat_template(p)
+        for picture in pictures:
+            p.drawPicture(0, 0, picture)
+        p.restore()
+    p.end()
 
-    with open("Library.xml", "w") as outFile:
-        write_header(outFile)
 
-        write_global_nav_setup(1, outFile)
-        write_submenu_setup(0, outFile)
+###############################################################################
+#
+# Profile model.
+#
+# A profile is plain data: the knobs, buttons and knob groups it assigns and
+# where it sits in the navigation. The XML and cheat image backends further
+# down both work from this model.
+#
+###############################################################################
 
-        for k in range(1,9):
-            draw_cheat_knob(p, k, "")
+# A knob assignment. Turning the knob sends the command, pushing it resets the
+# command.
+# index     The controller postion (1-8)
+# label     The cheat image label
+# color     Optional (r, g, b) fill of the knob in the cheat image
+# layers    The layers to assign the knob in ("A", "B" or "AB")
+#
+class Knob:
+    __slots__ = ("index", "command", "label", "color", "layers")
+
+    def __init__ (self, index, command, label="", color=None, layers="A"):
+        self.index   = index
+        self.command = command
+        self.label   = label
+        self.color   = tuple(color) if (color != None) else None
+        self.layers  = layers
+
+    def to_dict (self):
+        d = {"index": self.index, "command": self.command}
+        if (self.label != ""):
+            d["label"] = self.label
+        if (self.color != None):
+            d["color"] = list(self.color)
+        if (self.layers != "A"):
+            d["layers"] = self.layers
+        return d
+
+    @classmethod
+    def from_dict (cls, d):
+        return cls(d["index"], d["command"], d.get("label", ""), d.get("color"), d.get("layers", "A"))
+
+# A button assignment.
+# row       The button row (1 - upper, 2 - lower)
+# index     The button position (1-8)
+# label     The cheat image label
+# layers    The layers to assign the button in ("A", "B" or "AB")
+#
+class Button:
+    __slots__ = ("row", "index", "command", "label", "layers")
+
+    def __init__ (self, row, index, command, label="", layers="A"):
+        self.row     = row
+        self.index   = index
+        self.command = command
+        self.label   = label
+        self.layers  = layers
+
+    def to_dict (self):
+        d = {"row": self.row, "index": self.index, "command": self.command}
+        if (self.label != ""):
+            d["label"] = self.label
+        if (self.layers != "A"):
+            d["layers"] = self.layers
+        return d
+
+    @classmethod
+    def from_dict (cls, d):
+        return cls(d["row"], d["index"], d["command"], d.get("label", ""), d.get("layers", "A"))
+
+# A bracket drawn below the knobs first to last in the cheat image.
+#
+class KnobGroup:
+    __slots__ = ("first", "last", "label")
 
-        write_button_upper_a(1, "Pick", "Flag", p, outFile)
-        write_button_upper_a(2, "Reject", "Reject", p, outFile)
-        write_button_upper_a(3, "RemoveFlag", "Clear", p, outFile)
-        write_button_upper_a(4, "AddOrRemoveFromTargetColl", "Target", p, outFile)
-        draw_cheat_button(p, 1, 5, "")
-        draw_cheat_button(p, 1, 6, "")
-        
-        write_global_nav_keys(1, p, outFile)
+    def __init__ (self, first, last, label=""):
+        self.first = first
+        self.last  = last
+        self.label = label
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Library.png")
+    def to_dict (self):
+        return {"first": self.first, "last": self.last, "label": self.label}
 
+    @classmethod
+    def from_dict (cls, d):
+        return cls(d["first"], d["last"], d.get("label", ""))
 
-# Basic Profiles
+# A named set of navigation buttons shared by several profiles.
+#
+class NavBlock:
+    __slots__ = ("name", "title", "buttons")
 
+    def __init__ (self, name, title, buttons):
+        self.name    = name
+        self.title   = title
+        self.buttons = tuple(buttons)
 
+    def to_dict (self):
+        return {"title": self.title, "buttons": [b.to_dict() for b in self.buttons]}
 
-def write_profile_lens ():
+    @classmethod
+    def from_dict (cls, name, d):
+        return cls(name, d["title"], [Button.from_dict(b) for b in d["buttons"]])
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+# Where a profile sits in the navigation.
+# menu      The lit item of the global navigation in the lower button row (1-7)
+# submenu   The lit item of the sub-navigation in the upper button row (0 - none)
+# block     The sub-navigation NavBlock shown in the upper button row, or None
+#
+class NavState:
+    __slots__ = ("menu", "submenu", "block")
+
+    def __init__ (self, menu, submenu=0, block=None):
+        self.menu    = menu
+        self.submenu = submenu
+        self.block   = block
+
+    def to_dict (self):
+        d = {"menu": self.menu, "submenu": self.submenu}
+        if (self.block != None):
+            d["block"] = self.block.name
+        return d
+
+    @classmethod
+    def from_dict (cls, d, navBlocks):
+        block = None
+        if (d.get("block") != None):
+            block = navBlocks[d["block"]]
+        return cls(d["menu"], d.get("submenu", 0), block)
+
+# A complete profile. name is the base name of the XML and PNG output files.
+# The remaining fields describe how MIDI2LR switches to the profile (see
+# midi2lr_config.update_config):
+# series    The ActionSeries (and profileN slot) that selects the profile (0 - none)
+# actions   The commands ActionSeries series runs before switching profile
+# panels    The Lightroom modules and panels that select the profile
+#
+class Profile:
+    __slots__ = ("name", "nav", "knobs", "buttons", "groups", "series", "actions", "panels")
+
+    def __init__ (self, name, nav, knobs=(), buttons=(), groups=(), series=0, actions=(), panels=()):
+        self.name    = name
+        self.nav     = nav
+        self.knobs   = tuple(knobs)
+        self.buttons = tuple(buttons)
+        self.groups  = tuple(groups)
+        self.series  = series
+        self.actions = tuple(actions)
+        self.panels  = tuple(panels)
+
+    def to_dict (self):
+        d = {
+            "name": self.name,
+            "nav": self.nav.to_dict(),
+            "knobs": [k.to_dict() for k in self.knobs],
+            "buttons": [b.to_dict() for b in self.buttons],
+            "groups": [g.to_dict() for g in self.groups],
+        }
+        if (self.series > 0):
+            d["series"] = self.series
+        if (len(self.actions) > 0):
+            d["actions"] = list(self.actions)
+        if (len(self.panels) > 0):
+            d["panels"] = list(self.panels)
+        return d
+
+    @classmethod
+    def from_dict (cls, d, navBlocks):
+        return cls(d["name"],
+                   NavState.from_dict(d["nav"], navBlocks),
+                   [Knob.from_dict(k) for k in d.get("knobs", [])],
+                   [Button.from_dict(b) for b in d.get("buttons", [])],
+                   [KnobGroup.from_dict(g) for g in d.get("groups", [])],
+                   d.get("series", 0),
+                   d.get("actions", []),
+                   d.get("panels", []))
+
+# Profile families. A profile (as a dict, see Profile.to_dict) may extend a
+# base profile and override parts of it:
+# knobs     Merged by (index, layers): an entry replaces the fields it gives
+#           of the base knob at the same place, "command": None removes the
+#           knob, knobs the base does not have are added after its knobs
+# buttons   Merged the same way by (row, index, layers)
+# params    Merged with the params of the base. "$name" in the commands,
+#           labels, actions and panels of the flattened profile is replaced
+#           by param name.
+# Every other field given replaces the one of the base.
+
+def control_key (d):
+    return (d.get("row"), d["index"], d.get("layers", "A"))
+
+def merge_controls (base, overrides):
+    merged = {control_key(d): d for d in base}
+    for d in overrides:
+        key = control_key(d)
+        merged[key] = dict(merged.get(key, {}), **d)
+    return [d for d in merged.values() if d.get("command") != None]
+
+def merge_profile_dicts (base, override):
+    d = dict(base)
+    for field, value in override.items():
+        if (field in ("knobs", "buttons")):
+            d[field] = merge_controls(base.get(field, []), value)
+        elif (field == "params"):
+            d[field] = dict(base.get(field, {}), **value)
+        elif (field != "extends"):
+            d[field] = value
+    return d
+
+def substitute_params (text, params, name):
+    if ("$" not in text):
+        return text
+    try:
+        return string.Template(text).substitute(params)
+    except (KeyError, ValueError) as e:
+        raise ValueError("Profile "+name+": no value for param "+str(e)+" in \""+text+"\"") from None
+
+# Replace the params in a flattened profile dict.
+#
+def apply_params (d, params):
+    name = d.get("name", "?")
+    d = dict(d)
+    for field in ("knobs", "buttons"):
+        d[field] = [dict(c, command=substitute_params(c["command"], params, name),
+                         label=substitute_params(c.get("label", ""), params, name)) for c in d.get(field, [])]
+    for field in ("actions", "panels"):
+        d[field] = [substitute_params(v, params, name) for v in d.get(field, [])]
+    d.pop("params", None)
+    return d
+
+# Flatten profile dicts that extend others. bases maps the names that can be
+# extended to their dicts. Every base is flattened once, however many
+# profiles extend it.
+#
+class ProfileFlattener:
+    __slots__ = ("bases", "memo", "resolving")
+
+    def __init__ (self, bases):
+        self.bases = bases
+        self.memo = {}
+        self.resolving = []
+
+    def base (self, name):
+        d = self.memo.get(name)
+        if (d != None):
+            return d
+        if (name in self.resolving):
+            raise ValueError("Circular profile extends: "+" -> ".join(self.resolving+[name]))
+        if (name not in self.bases):
+            raise ValueError("Unknown profile to extend: "+name)
+
+        self.resolving.append(name)
+        try:
+            d = self.merge(self.bases[name])
+        finally:
+            self.resolving.pop()
+        self.memo[name] = d
+        return d
+
+    # The profile merged with its bases, params not yet replaced.
+    #
+    def merge (self, d):
+        if (d.get("extends") == None):
+            return d
+        return merge_profile_dicts(self.base(d["extends"]), d)
+
+    def flatten (self, d):
+        d = self.merge(d)
+        return apply_params(d, d.get("params", {}))
+
+# A profile derived from base with the given overrides (see the rules
+# above). Knobs and buttons only override the fields they set: empty labels
+# and missing colors keep those of the base.
+#
+def derive_profile (base, name, nav=None, knobs=(), buttons=(), groups=None, series=None, actions=None,
+                    panels=None, params=None):
+    override = {"name": name, "knobs": [k.to_dict() for k in knobs], "buttons": [b.to_dict() for b in buttons]}
+    navBlocks = {}
+    for state in (base.nav, nav):
+        if (state != None and state.block != None):
+            navBlocks[state.block.name] = state.block
+    if (nav != None):
+        override["nav"] = nav.to_dict()
+    if (groups != None):
+        override["groups"] = [g.to_dict() for g in groups]
+    if (series != None):
+        override["series"] = series
+    if (actions != None):
+        override["actions"] = list(actions)
+    if (panels != None):
+        override["panels"] = list(panels)
+
+    d = merge_profile_dicts(base.to_dict(), override)
+    return Profile.from_dict(apply_params(d, params or {}), navBlocks)
+
+# Convert a profile spec (as read from JSON, TOML or YAML) into profiles. The
+# spec has a "profiles" list and may define additional "navBlocks"; nav blocks
+# are referenced by name and default to the built-in ones. Profiles may
+# "extend" another profile or one of the "families", base profiles that are
+# not built themselves.
+#
+def profiles_from_dict (data):
+    navBlocks = dict(kNavBlocks)
+    for name, d in data.get("navBlocks", {}).items():
+        navBlocks[name] = NavBlock.from_dict(name, d)
 
-    with open("Lens.xml", "w") as outFile:
-        write_header(outFile)
+    bases = {d["name"]: d for d in data["profiles"]}
+    bases.update(data.get("families", {}))
+    flattener = ProfileFlattener(bases)
 
-        write_submenu_setup(1, outFile)
-        write_global_nav_setup(2, outFile)
+    return [Profile.from_dict(flattener.flatten(d), navBlocks) for d in data["profiles"]]
 
-        write_knob_a(1, "LensManualDistortionAmount", "Distortion", p, outFile)
-        write_knob_a(2, "DefringePurpleAmount", "Amount", p, outFile, QColor(90, 0, 180))
-        write_knob_a(3, "DefringePurpleHueLo", "Hue Lo", p, outFile, QColor(90, 0, 180))
-        write_knob_a(4, "DefringePurpleHueHi", "Hue Hi", p, outFile, QColor(90, 0, 180))
-        draw_cheat_knob_group(p, 2, 4, "Purple")
-        write_knob_a(5, "DefringeGreenAmount", "Amount", p, outFile, QColor(0, 150, 0))
-        write_knob_a(6, "DefringeGreenHueLo", "Hue Lo", p, outFile, QColor(0, 150, 0))
-        write_knob_a(7, "DefringeGreenHueHi", "Hue Hi", p, outFile, QColor(0, 150, 0))
-        draw_cheat_knob_group(p, 5, 7, "Green")
-        draw_cheat_knob(p, 8, "")
+def profiles_to_dict (profiles):
+    navBlocks = {}
+    for profile in profiles:
+        if (profile.nav.block != None):
+            navBlocks[profile.nav.block.name] = profile.nav.block.to_dict()
 
-        write_button_upper_a(6, "EnableLensCorrections", "On/Off", p, outFile)
+    return {"navBlocks": navBlocks, "profiles": [p.to_dict() for p in profiles]}
 
-        write_nav_basic(1, p, outFile)
-        write_global_nav_keys(2, p, outFile)
+# Load profiles from a .json, .toml or .yaml profile spec file. TOML needs
+# Python 3.11 or the tomli package, YAML needs PyYAML.
+#
+def load_profiles (fileName):
+    ext = os.path.splitext(fileName)[1].lower()
+
+    if (ext == ".json"):
+        with open(fileName) as f:
+            data = json.load(f)
+    elif (ext == ".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(fileName, "rb") as f:
+            data = tomllib.load(f)
+    elif (ext in (".yaml", ".yml")):
+        import yaml
+        with open(fileName) as f:
+            data = yaml.safe_load(f)
+    else:
+        raise ValueError("Unknown profile spec format: "+fileName)
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Lens.png")
+    return profiles_from_dict(data)
 
+def save_profiles (profiles, fileName):
+    with open(fileName, "w") as f:
+        json.dump(profiles_to_dict(profiles), f, indent=2)
+        f.write("\n")
 
-def write_profile_transform ():
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+###############################################################################
+#
+# Global assignment blocks (navigation).
+#
+###############################################################################
 
-    with open("Transform.xml", "w") as outFile:
-        write_header(outFile)
+def write_global_nav_setup (activeItem, outFile, addresses=None):
+    write_comment("Global Navigation Setup", outFile)
+    
+    for index in range (1, 8):
+        value = 0
+        if (index == activeItem):
+            value = 1
 
-        write_submenu_setup(2, outFile)
-        write_global_nav_setup(2, outFile)
+        write_button_setup_layers("AB", 2, index, value, outFile, addresses)
 
-        write_knob_a(1, "PerspectiveVertical", "Vertical", p, outFile)
-        write_knob_a(2, "PerspectiveHorizontal", "Horizontal", p, outFile)
-        write_knob_a(3, "PerspectiveRotate", "Rotate", p, outFile)
-        write_knob_a(4, "PerspectiveScale", "Scale", p, outFile)
-        write_knob_a(5, "PerspectiveX", "Offset X", p, outFile)
-        write_knob_a(6, "PerspectiveY", "Offset Y", p, outFile)
-        draw_cheat_knob(p, 7, "")
-        draw_cheat_knob(p, 8, "")
+def write_submenu_setup (activeItem, outFile, addresses=None):
+    write_comment("Submenu Navigation Setup", outFile)
+    
+    for index in range (1, 6):
+        value = 0
+        if (index == activeItem):
+            value = 1
 
-        write_button_upper_a(5, "CropConstrainToWarp", "Crop", p, outFile)
-        write_button_upper_a(6, "EnableTransform", "On/Off", p, outFile)
+        write_button_setup_layers("AB", 1, index, value, outFile, addresses)
 
-        write_nav_basic(2, p, outFile)
-        write_global_nav_keys(2, p, outFile)
+# Submenu in upper key row for Basic mode
+#
+kNavBasic = NavBlock("basic", "Basic", [
+    Button(1, 1, "RevealPanelLens", "Lens", "AB"),
+    Button(1, 2, "ActionSeries4", "Transform", "AB"),
+    Button(1, 3, "CropOverlay", "Crop", "AB"),
+])
+
+kNavColors1 = NavBlock("colors_1", "Colors 1", [
+    Button(1, 1, "ActionSeries2", "Tone", "AB"),
+    Button(1, 2, "ActionSeries3", "Presence", "AB"),
+    Button(1, 3, "GraduatedFilter", "Gradient", "AB"),
+    Button(1, 4, "AdjustmentBrush", "Brush", "AB"),
+    Button(1, 5, "RevealPanelTone", "Tone Curve", "AB"),
+])
+
+kNavColors2 = NavBlock("colors_2", "Colors 2", [
+    Button(1, 1, "ActionSeries5", "Hue", "AB"),
+    Button(1, 2, "ActionSeries6", "Saturation", "AB"),
+    Button(1, 3, "ActionSeries7", "Luminance", "AB"),
+])
+
+kNavEnhance = NavBlock("enhance", "Enhance", [
+    Button(1, 1, "RevealPanelEffects", "Effects", "AB"),
+    Button(1, 2, "RevealPanelDetail", "Detail", "AB"),
+])
+
+kNavGrading = NavBlock("grading", "Grading", [
+    Button(1, 1, "ActionSeries9", "Midtones", "AB"),
+    Button(1, 2, "ActionSeries10", "Highlights", "AB"),
+    Button(1, 3, "ActionSeries11", "Shadows", "AB"),
+    Button(1, 4, "ActionSeries12", "Global", "AB"),
+])
+
+kNavBlocks = {b.name: b for b in (kNavBasic, kNavColors1, kNavColors2, kNavEnhance, kNavGrading)}
+
+# Global navigation, assigned in every profile.
+#
+kNavGlobal = NavBlock("global", "Global", [
+    Button(1, 7, "Key3", "Before/After", "AB"),
+    Button(1, 8, "Key1", "Clipping", "AB"),
+    Button(2, 1, "ActionSeries1", "Library", "AB"),
+    Button(2, 2, "RevealPanelLens", "Basic", "AB"),
+    Button(2, 3, "ActionSeries2", "Colours 1", "AB"),
+    Button(2, 4, "ActionSeries5", "Colours 2", "AB"),
+    Button(2, 5, "ActionSeries8", "Grayscale", "AB"),
+    Button(2, 6, "RevealPanelEffects", "Enhance", "AB"),
+    Button(2, 7, "ActionSeries9", "Grading", "AB"),
+    Button(2, 8, "ToggleZoomOffOn", "Zoom", "AB"),
+])
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Transform.png")
 
-def write_profile_crop ():
+###############################################################################
+#
+# Navigation fragments.
+#
+# Every profile shows the global navigation and most show a sub-navigation
+# block; only the lit item differs. The XML and the drawing of a block with a
+# lit item are made once per process and spliced into every profile showing
+# them, and so are the template images with the navigation drawn in.
+#
+# Fragments are keyed by (block, lit item, cheat layout) and remember the
+# block definition they were made from, so an edited block (e.g. in --watch
+# mode) remakes the fragments and images of that block only.
+#
+###############################################################################
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+# The navigation of one block with a lit item.
+# block     The NavBlock, or None for a profile without sub-navigation
+# item      The lit item (0 - none)
+# isGlobal  The global navigation in the lower row, else a sub-navigation in
+#           the upper row
+#
+class NavFragment:
+    __slots__ = ("block", "item", "isGlobal", "fingerprint", "addresses", "setupXml", "buttonsXml", "pictures")
+
+    def __init__ (self, block, item, isGlobal, fingerprint):
+        self.block       = block
+        self.item        = item
+        self.isGlobal    = isGlobal
+        self.fingerprint = fingerprint
+        self.addresses   = None
+        self.setupXml    = None
+        self.buttonsXml  = None
+        self.pictures    = {}
+
+    # Make the XML for addresses: the LED setups and the button settings.
+    #
+    def make_xml (self, addresses):
+        setup = io.StringIO()
+        if (self.isGlobal):
+            write_global_nav_setup(self.item, setup, addresses)
+        else:
+            write_submenu_setup(self.item, setup, addresses)
+
+        buttons = io.StringIO()
+        if (self.block != None):
+            write_comment("Global Navigation" if self.isGlobal else self.block.title+" Profile Sub-Navigation", buttons)
+            for button in self.block.buttons:
+                write_button(button, buttons, addresses)
+
+        self.addresses  = addresses
+        self.setupXml   = setup.getvalue()
+        self.buttonsXml = buttons.getvalue()
+
+    # The recorded drawing of the block's buttons in a layer and the lit item.
+    #
+    def picture (self, layer):
+        picture = self.pictures.get(layer)
+        if (picture == None):
+            picture = QPicture()
+            p = QPainter(picture)
+            p.setRenderHint(QPainter.Antialiasing)
+            draw_nav_block(p, self.block, 2 if self.isGlobal else 1, self.item, layer)
+            p.end()
+            self.pictures[layer] = picture
+        return picture
+
+navFragments = {}
+navImages = {}
+
+def nav_block_fingerprint (block):
+    if (block == None):
+        return None
+    return json.dumps(block.to_dict(), sort_keys=True)
+
+# The fragment of block with item lit, made for addresses.
+#
+def nav_fragment (block, item, addresses, isGlobal=False):
+    key = (isGlobal, None if block == None else block.name, item, cheatLayout.key)
+    fingerprint = nav_block_fingerprint(block)
+
+    fragment = navFragments.get(key)
+    if (fragment == None or fragment.fingerprint != fingerprint):
+        renderCacheStats["misses"] += 1
+        if (fragment != None):
+            for imageKey in [k for k in navImages if fragment in k[:2]]:
+                del navImages[imageKey]
+        fragment = NavFragment(block, item, isGlobal, fingerprint)
+        navFragments[key] = fragment
+    else:
+        renderCacheStats["hits"] += 1
 
-    with open("Crop.xml", "w") as outFile:
-        write_header(outFile)
+    if (fragment.addresses is not addresses and fragment.addresses != addresses):
+        fragment.make_xml(addresses)
+    return fragment
 
-        write_submenu_setup(3, outFile)
-        write_global_nav_setup(2, outFile)
+# The sub-navigation and global navigation fragments of a profile.
+#
+def profile_nav_fragments (profile, addresses=None):
+    addresses = addresses or kAddressMap
+    return (nav_fragment(profile.nav.block, profile.nav.submenu, addresses),
+            nav_fragment(kNavGlobal, profile.nav.menu, addresses, True))
 
-        write_knob_a(1, "CropTop", "Top", p, outFile)
-        write_knob_a(2, "CropLeft", "Left", p, outFile)
-        write_knob_a(3, "CropRight", "Right", p, outFile)
-        write_knob_a(4, "CropBottom", "Bottom", p, outFile)
-        write_knob_a(5, "straightenAngle", "Angle", p, outFile)
-        draw_cheat_knob(p, 6, "")
-        draw_cheat_knob(p, 7, "")
-        draw_cheat_knob(p, 8, "")
+# The cheat image template at scale with the navigation of fragments drawn in
+# a layer. Shared; copy it before painting on it.
+#
+def nav_base_image (fragments, layer, scale=1):
+    key = tuple(fragments)+(layer, scale)
+    img = navImages.get(key)
+    if (img == None):
+        renderCacheStats["misses"] += 1
+        img = init_cheat_image(scale)
+        p = init_cheat_painting(img, scale)
+        for fragment in fragments:
+            p.drawPicture(0, 0, fragment.picture(layer))
+        p.end()
+        navImages[key] = img
+    else:
+        renderCacheStats["hits"] += 1
+    return img
 
-        # Keyboard shortcut definition 2: l - lights out
-        write_button_upper_a(6, "Key2", "Lights Out", p, outFile)
 
-        write_nav_basic(3, p, outFile)
-        write_global_nav_keys(2, p, outFile)
+###############################################################################
+#
+# Profile backends: XML profile and cheat image.
+#
+###############################################################################
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Crop.png")
+def write_button (button, outFile, addresses=None):
+    write_button_layers(button.layers, button.row, button.index, button.command, outFile, addresses)
 
-# Colors 1 Profiles
+def write_profile_xml (profile, outFile, addresses=None, device=None):
+    addresses = addresses or kAddressMap
+    device = device or kDeviceXTouchMini
 
-def write_profile_tone ():
+    fragments = profile_nav_fragments(profile, addresses)
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+    write_header(outFile, device.title)
 
-    with open("Tone.xml", "w") as outFile:
-        write_header(outFile)
+    for fragment in fragments:
+        outFile.write(fragment.setupXml)
 
-        write_submenu_setup(1, outFile)
-        write_global_nav_setup(3, outFile)
+    for layer in ("A", "B"):
+        for knob in profile.knobs:
+            if (layer in knob.layers):
+                write_knob(layer, knob.index, knob.command, outFile, addresses)
 
-        write_knob_a(1, "Whites", "Whites", p, outFile, QColor(200, 200, 200))
-        write_knob_a(2, "Highlights", "Highlights", p, outFile, QColor(160, 160, 160))
-        write_knob_a(3, "Shadows", "Shadows", p, outFile, QColor(80, 80, 80))
-        write_knob_a(4, "Blacks", "Blacks", p, outFile, QColor(30, 30, 30))
-        draw_cheat_knob_group(p, 1, 4, "")
-        write_knob_a(5, "Temperature", "Temp", p, outFile)
-        write_knob_a(6, "Tint", "Tint", p, outFile)
-        draw_cheat_knob_group(p, 5, 6, "WB")
-        write_knob_a(7, "Exposure", "Exposure", p, outFile)
-        write_knob_a(8, "Contrast", "Contrast", p, outFile)
+    for button in profile.buttons:
+        write_button(button, outFile, addresses)
 
-        print("", file=outFile)
+    for fragment in fragments:
+        outFile.write(fragment.buttonsXml)
 
-        write_nav_colors_1(1, p, outFile)
-        write_global_nav_keys(3, p, outFile)
+    write_footer(outFile)
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Tone.png")
+# All buttons a profile assigns, including the navigation.
+#
+def profile_buttons (profile):
+    buttons = list(profile.buttons)
+    if (profile.nav.block != None):
+        buttons.extend(profile.nav.block.buttons)
+    buttons.extend(kNavGlobal.buttons)
+    return buttons
+
+# All commands a profile assigns, including the navigation.
+#
+def profile_commands (profile):
+    return [k.command for k in profile.knobs]+[b.command for b in profile_buttons(profile)]
 
-def write_profile_presence ():
+# The cheat image label of a knob or button. Controls without a label of
+# their own are labeled from the catalogue (midi2lr_commands.command_label).
+#
+def control_label (control):
+    if (control.label != ""):
+        return control.label
+    return midi2lr_commands.command_label(control.command)
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+# Draw the buttons of a navigation block (None - none) in a layer and light
+# item (0 - none) in row.
+#
+def draw_nav_block (p, block, row, item, layer):
+    if (block != None):
+        for button in block.buttons:
+            if (layer in button.layers):
+                draw_cheat_button(p, button.row, button.index, control_label(button))
+    if (item > 0):
+        draw_cheat_button(p, row, item, "", 1)
+
+# Draw the knobs and the own buttons of a profile in a layer, the parts of
+# the cheat image that are not navigation. Buttons in the place of a
+# navigation button are left to the navigation.
+#
+def draw_profile_controls (profile, p, layer="A"):
+    draw_profile_knobs(profile, p, layer)
 
-    with open("Presence.xml", "w") as outFile:
-        write_header(outFile)
+    navButtons = set()
+    for block in (profile.nav.block, kNavGlobal):
+        if (block != None):
+            navButtons.update((b.row, b.index) for b in block.buttons if layer in b.layers)
 
-        write_submenu_setup(2, outFile)
-        write_global_nav_setup(3, outFile)
+    for button in profile.buttons:
+        if (layer in button.layers and (button.row, button.index) not in navButtons):
+            draw_cheat_button(p, button.row, button.index, control_label(button))
 
-        write_knob_a(1, "Texture", "Texture", p, outFile)
-        write_knob_a(2, "Clarity", "Clarity", p, outFile)
-        write_knob_a(3, "Dehaze", "Dehaze", p, outFile)
-        write_knob_a(4, "Vibrance", "Vibrance", p, outFile)
-        write_knob_a(5, "Saturation", "Saturation", p, outFile)
-        draw_cheat_knob(p, 6, "")
-        draw_cheat_knob(p, 7, "")
-        draw_cheat_knob(p, 8, "")
+# Draw the knobs and knob groups of a profile in a layer ("A" or "B"). Every
+# knob is drawn, unassigned ones without a label. Knob groups describe the
+# layer A knobs and are only drawn there.
+#
+def draw_profile_knobs (profile, p, layer="A"):
+    knobs = {}
+    for knob in profile.knobs:
+        if (layer in knob.layers):
+            knobs[knob.index] = knob
+
+    for col in range(1, cheatLayout.columns+1):
+        knob = knobs.get(col)
+        if (knob == None):
+            draw_cheat_knob(p, col, "")
+        elif (knob.color != None):
+            draw_cheat_knob(p, col, control_label(knob), knob.color)
+        else:
+            draw_cheat_knob(p, col, control_label(knob))
+
+    if (layer == "A"):
+        for group in profile.groups:
+            draw_cheat_knob_group(p, group.first, group.last, group.label)
+
+# Draw a profile imported without navigation (see import_profile_xml) as it
+# is: all of its knobs and buttons in a layer and the lit menu and submenu
+# items, without the generator's navigation.
+#
+def draw_imported_profile (profile, p, layer="A"):
+    draw_profile_knobs(profile, p, layer)
+    for button in profile.buttons:
+        if (layer in button.layers):
+            draw_cheat_button(p, button.row, button.index, control_label(button))
+    draw_nav_block(p, None, 1, profile.nav.submenu, layer)
+    draw_nav_block(p, None, 2, profile.nav.menu, layer)
+
+# Write data to fileName with a single write. With atomic the data goes to a
+# temporary file next to fileName first, which then replaces fileName, so a
+# reader (Lightroom) never sees a partially written profile.
+#
+def write_output_file (fileName, data, atomic=False):
+    if (not atomic):
+        with open(fileName, "w") as f:
+            f.write(data)
+        return
+
+    tmpName = fileName+"."+str(os.getpid())+".tmp"
+    try:
+        with open(tmpName, "w") as f:
+            f.write(data)
+        os.replace(tmpName, fileName)
+    except BaseException:
+        if (os.path.exists(tmpName)):
+            os.remove(tmpName)
+        raise
+
+# Record the drawing of a profile's cheat image once. The recording holds the
+# laid out shapes and text in layout coordinates and is replayed at every
+# scale the build writes. The navigation is not part of it; it comes from
+# the shared navigation fragments.
+#
+def layout_profile_image (profile, layer="A"):
+    picture = QPicture()
+    p = QPainter(picture)
+    p.setRenderHint(QPainter.Antialiasing)
+    draw_profile_controls(profile, p, layer)
+    p.end()
+    return picture
 
-        write_nav_colors_1(2, p, outFile)
-        write_global_nav_keys(3, p, outFile)
+# The cheat sheets of a profile as (name, layers) pairs; a sheet shows its
+# layers stacked top to bottom. layerB selects how layer B is shown:
+# None      Not at all, one sheet "name" of layer A
+# "sheet"   In a second sheet "name-B"
+# "combined" Below layer A in sheet "name"
+#
+def cheat_sheets (profile, layerB=None):
+    if (layerB == "sheet"):
+        return [(profile.name, "A"), (profile.name+"-B", "B")]
+    if (layerB == "combined"):
+        return [(profile.name, "AB")]
+    return [(profile.name, "A")]
+
+# The layouts of the layers a profile's cheat sheets show, by layer.
+#
+def layout_profile_layers (profile, sheets):
+    layers = sorted(set("".join(layers for name, layers in sheets)))
+    return {layer: layout_profile_image(profile, layer) for layer in layers}
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Presence.png")
+# Draw the layouts of layers on a sheet image from init_cheat_sheet_image().
+#
+def draw_cheat_sheet (p, pictures, layers):
+    for n, layer in enumerate(layers):
+        p.drawPicture(0, cheatLayout.height*n, pictures[layer])
 
-def write_profile_gradient ():
+# The cheat image file name of a sheet at a scale: 1 - "name.png",
+# 2 - "name@2x.png", "svg" - "name.svg". ext is the extension of bitmaps.
+#
+def cheat_image_name (name, scale, ext=".png"):
+    if (scale == "svg"):
+        return name+".svg"
+    if (scale == 1):
+        return name+ext
+    return name+"@"+("%g" % scale)+"x"+ext
+
+# Write the cheat images of sheet name at every scale of options. The sheet
+# shows layers stacked top to bottom, each the navigation of fragments (see
+# init_cheat_sheet_image) with the layout from pictures, by layer, on top.
+# The timing phases are recorded for profileName. Returns the (file name,
+# size, seconds) of each encoded image.
+#
+def write_sheet_images (name, layers, fragments, pictures, options, profileName):
+    images = []
+    for scale in options.scales:
+        if (scale == "svg"):
+            layouts = [[f.picture(layer) for f in fragments]+[pictures[layer]] for layer in layers]
+            with timed_phase("encode", profileName):
+                write_cheat_svg(layouts, options.path(cheat_image_name(name, scale)), name)
+            continue
+
+        with timed_phase("init-image", profileName):
+            img = init_cheat_sheet_image(fragments, layers, scale)
+        with timed_phase("init-painting", profileName):
+            p = init_cheat_painting(img, scale)
+        with timed_phase("draw", profileName):
+            draw_cheat_sheet(p, pictures, layers)
+        fileName = cheat_image_name(name, scale, options.encoding.extension())
+        with timed_phase("encode", profileName):
+            start = time.perf_counter()
+            size = write_cheat_image(p, img, options.path(fileName), options.encoding)
+            images.append((fileName, size, time.perf_counter()-start))
+    return images
+
+# Write the XML profile and the cheat images of a profile. Returns the
+# (file name, size, seconds) of each encoded cheat image.
+#
+def write_profile (profile, options):
+    images = []
+    with timed_phase("xml", profile.name):
+        outFile = io.StringIO()
+        write_profile_xml(profile, outFile, options.addresses, options.device)
+        write_output_file(options.path(profile.name+".xml"), outFile.getvalue(), options.atomic)
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+    # With atlases the cheat images are drawn by build_atlases().
+    if (options.xmlOnly or options.atlas != None):
+        return images
 
-    with open("Gradient.xml", "w") as outFile:
-        write_header(outFile)
+    sheets = cheat_sheets(profile, options.layerB)
+    with timed_phase("layout", profile.name):
+        fragments = profile_nav_fragments(profile, options.addresses)
+        pictures = layout_profile_layers(profile, sheets)
 
-        write_submenu_setup(3, outFile)
-        write_global_nav_setup(3, outFile)
+    for name, layers in sheets:
+        images.extend(write_sheet_images(name, layers, fragments, pictures, options, profile.name))
 
-        write_knob_a(1, "local_Exposure", "Exposure", p, outFile)
-        write_knob_a(2, "local_Contrast", "Contrast", p, outFile)
-        write_knob_a(3, "local_Highlights", "Highlights", p, outFile)
-        write_knob_a(4, "local_Shadows", "Shadows", p, outFile)
-        write_knob_a(5, "local_Whites2012", "Whites", p, outFile)
-        write_knob_a(6, "local_Blacks2012", "Blacks", p, outFile)
-        write_knob_a(7, "local_Clarity", "Clarity", p, outFile)
-        write_knob_a(8, "local_Dehaze", "Dehaze", p, outFile)
+    return images
 
-        write_knob_b(1, "local_Temperature", outFile)
-        write_knob_b(2, "local_Tint", outFile)
-        # local_Vibrance does not exist
-        write_knob_b(4, "local_Saturation", outFile)
-        write_knob_b(5, "local_Sharpness", outFile)
-        write_knob_b(6, "local_LuminanceNoise", outFile)
-        write_knob_b(7, "local_Moire", outFile)
-        write_knob_b(8, "local_Defringe", outFile)
+# The files written for a profile.
+#
+def profile_outputs (profile, options):
+    if (options.xmlOnly or options.atlas != None):
+        return [profile.name+".xml"]
+    ext = options.encoding.extension()
+    return [profile.name+".xml"]+[cheat_image_name(name, scale, ext)
+                                  for scale in options.scales for name, layers in cheat_sheets(profile, options.layerB)]
 
-        write_button_upper_ab(6, "EnableGradientBasedCorrections", "On/Off", p, outFile)
 
-        write_nav_colors_1(3, p, outFile)
-        write_global_nav_keys(3, p, outFile)
+# Cheat image atlases: the cheat images of several profiles side by side in
+# one image, for clients that would rather load a single file. The atlas
+# index (kAtlasIndexFile) records where each profile's image is.
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Gradient.png")
+kAtlasIndexFile = "atlas.json"
 
-def write_profile_brush ():
+# The name of the navigation group a profile belongs to: the label of its lit
+# global navigation button.
+#
+def profile_group (profile):
+    for button in kNavGlobal.buttons:
+        if (button.row == 2 and button.index == profile.nav.menu):
+            return button.label
+    return "Menu "+str(profile.nav.menu)
+
+# Split the profiles into atlases. mode "all" puts every profile in one atlas
+# "atlas", mode "group" makes one atlas per navigation group, e.g.
+# "atlas-colours-1". Returns (name, group, profiles) tuples, none for no
+# profiles.
+#
+def atlas_groups (profiles, mode):
+    if (not profiles):
+        return []
+    if (mode == "all"):
+        return [("atlas", None, list(profiles))]
+
+    groups = {}
+    for profile in profiles:
+        groups.setdefault(profile_group(profile), []).append(profile)
+    return [("atlas-"+re.sub(r"[^a-z0-9]+", "-", group.lower()).strip("-"), group, members)
+            for group, members in groups.items()]
+
+# The columns and rows of a grid of count images with the given aspect
+# ratio (height / width) that is about as tall as it is wide.
+#
+def atlas_grid (count, aspect=kImgH/kImgW):
+    cols = max(1, int(round((count*aspect)**0.5)))
+    return cols, (count+cols-1)//cols
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+def atlas_image_name (name, scale, ext=".png"):
+    if (scale == 1):
+        return name+ext
+    return name+"@"+("%g" % scale)+"x"+ext
 
-    with open("Brush.xml", "w") as outFile:
-        write_header(outFile)
+# Draw the cheat sheets of profiles into one image at scale and write it.
+# Returns the index entry: the image size and each sheet's rectangle.
+#
+def write_atlas (name, group, profiles, scale, options):
+    cells = []
+    for profile in profiles:
+        sheets = cheat_sheets(profile, options.layerB)
+        fragments = profile_nav_fragments(profile, options.addresses)
+        pictures = layout_profile_layers(profile, sheets)
+        cells.extend((sheetName, layers, fragments, pictures) for sheetName, layers in sheets)
 
-        write_submenu_setup(4, outFile)
-        write_global_nav_setup(3, outFile)
+    template = cheat_template(scale)
+    cellW, cellH = template.width(), template.height()*len(cells[0][1])
+    cols, rows = atlas_grid(len(cells), cellH/cellW)
 
-        write_knob_a(1, "local_Exposure", "Exposure", p, outFile)
-        write_knob_a(2, "local_Contrast", "Contrast", p, outFile)
-        write_knob_a(3, "local_Highlights", "Highlights", p, outFile)
-        write_knob_a(4, "local_Shadows", "Shadows", p, outFile)
-        write_knob_a(5, "local_Whites2012", "Whites", p, outFile)
-        write_knob_a(6, "local_Blacks2012", "Blacks", p, outFile)
-        write_knob_a(7, "local_Clarity", "Clarity", p, outFile)
-        write_knob_a(8, "local_Dehaze", "Dehaze", p, outFile)
+    img = QImage(cols*cellW, rows*cellH, QImage.Format_ARGB32)
+    img.fill(cheat_color(kColorBg))
 
-        write_knob_b(1, "local_Temperature", outFile)
-        write_knob_b(2, "local_Tint", outFile)
-        # local_Vibrance does not exist
-        write_knob_b(4, "local_Saturation", outFile)
-        write_knob_b(5, "local_Sharpness", outFile)
-        write_knob_b(6, "local_LuminanceNoise", outFile)
-        write_knob_b(7, "ChangeFeatherSize", outFile)
-        write_knob_b(8, "ChangeBrushSize", outFile)
+    p = QPainter(img)
+    p.setRenderHint(QPainter.Antialiasing)
+    rects = {}
+    for n, (sheetName, layers, fragments, pictures) in enumerate(cells):
+        x, y = (n % cols)*cellW, (n // cols)*cellH
+        rects[sheetName] = {"x": x, "y": y, "w": cellW, "h": cellH}
 
-        write_button_upper_ab(6, "EnablePaintBasedCorrections", "On/Off", p, outFile)
+        p.save()
+        p.setClipRect(QRect(x, y, cellW, cellH))
+        for m, layer in enumerate(layers):
+            p.drawImage(QPoint(x, y+template.height()*m), nav_base_image(fragments, layer, scale))
+        p.translate(x, y)
+        if (scale != 1):
+            p.scale(scale, scale)
+        draw_cheat_sheet(p, pictures, layers)
+        p.restore()
 
-        write_nav_colors_1(4, p, outFile)
-        write_global_nav_keys(3, p, outFile)
+    fileName = atlas_image_name(name, scale, options.encoding.extension())
+    write_cheat_image(p, img, options.path(fileName), options.encoding)
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Brush.png")
+    return {"image": fileName, "group": group, "scale": scale,
+            "width": img.width(), "height": img.height(), "profiles": rects}
 
-def write_profile_tone_curve ():
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+###############################################################################
+#
+# Profiles.
+#
+###############################################################################
 
-    with open("ToneCurve.xml", "w") as outFile:
-        write_header(outFile)
+# Library
 
-        write_submenu_setup(5, outFile)
-        write_global_nav_setup(3, outFile)
+kProfileLibrary = Profile("Library", NavState(1),
+    buttons = [
+        Button(1, 1, "Pick", "Flag"),
+        Button(1, 2, "Reject", "Reject"),
+        Button(1, 3, "RemoveFlag", "Clear"),
+        Button(1, 4, "AddOrRemoveFromTargetColl", "Target"),
+    ],
+    series = 1,
+    actions = ["ShoVwgrid"],
+    panels = ["print", "library", "book", "web", "map", "slideshow"])
 
-        write_knob_a(1, "ParametricHighlights", "Highlights", p, outFile, QColor(200, 200, 200))
-        write_knob_a(2, "ParametricLights", "Lights", p, outFile, QColor(160, 160, 160))
-        write_knob_a(3, "ParametricDarks", "Darks", p, outFile, QColor(80, 80, 80))
-        write_knob_a(4, "ParametricShadows", "Shadows", p, outFile, QColor(30, 30, 30))
-        draw_cheat_knob_group(p, 1, 4, "")
-        write_knob_a(5, "ParametricHighlightSplit", "Split High", p, outFile, QColor(160, 160, 160))
-        write_knob_a(6, "ParametricMidtoneSplit", "Split Mid", p, outFile, QColor(80, 80, 80))
-        write_knob_a(7, "ParametricShadowSplit", "Split Low", p, outFile, QColor(30, 30, 30))
-        draw_cheat_knob_group(p, 5, 7, "")
-        draw_cheat_knob(p, 8, "")
+# Basic Profiles
 
-        write_button_upper_ab(6, "EnableToneCurve", "On/Off", p, outFile)
+kProfileLens = Profile("Lens", NavState(2, 1, kNavBasic),
+    knobs = [
+        Knob(1, "LensManualDistortionAmount", "Distortion"),
+        Knob(2, "DefringePurpleAmount", "Amount", (90, 0, 180)),
+        Knob(3, "DefringePurpleHueLo", "Hue Lo", (90, 0, 180)),
+        Knob(4, "DefringePurpleHueHi", "Hue Hi", (90, 0, 180)),
+        Knob(5, "DefringeGreenAmount", "Amount", (0, 150, 0)),
+        Knob(6, "DefringeGreenHueLo", "Hue Lo", (0, 150, 0)),
+        Knob(7, "DefringeGreenHueHi", "Hue Hi", (0, 150, 0)),
+    ],
+    groups = [
+        KnobGroup(2, 4, "Purple"),
+        KnobGroup(5, 7, "Green"),
+    ],
+    buttons = [
+        Button(1, 6, "EnableLensCorrections", "On/Off"),
+    ],
+    panels = ["lensCorrectionsPanel", "calibratePanel"])
+
+kProfileTransform = Profile("Transform", NavState(2, 2, kNavBasic),
+    knobs = [
+        Knob(1, "PerspectiveVertical", "Vertical"),
+        Knob(2, "PerspectiveHorizontal", "Horizontal"),
+        Knob(3, "PerspectiveRotate", "Rotate"),
+        Knob(4, "PerspectiveScale", "Scale"),
+        Knob(5, "PerspectiveX", "Offset X"),
+        Knob(6, "PerspectiveY", "Offset Y"),
+    ],
+    buttons = [
+        Button(1, 5, "CropConstrainToWarp", "Crop"),
+        Button(1, 6, "EnableTransform", "On/Off"),
+    ],
+    series = 4,
+    actions = ["RevealPanelTransform"],
+    panels = ["transformPanel"])
+
+kProfileCrop = Profile("Crop", NavState(2, 3, kNavBasic),
+    knobs = [
+        Knob(1, "CropTop", "Top"),
+        Knob(2, "CropLeft", "Left"),
+        Knob(3, "CropRight", "Right"),
+        Knob(4, "CropBottom", "Bottom"),
+        Knob(5, "straightenAngle", "Angle"),
+    ],
+    buttons = [
+        # Keyboard shortcut definition 2: l - lights out
+        Button(1, 6, "Key2", "Lights Out"),
+    ],
+    panels = ["develop", "crop"])
 
-        write_nav_colors_1(5, p, outFile)
-        write_global_nav_keys(3, p, outFile)
+# Colors 1 Profiles
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./ToneCurve.png")
+kProfileTone = Profile("Tone", NavState(3, 1, kNavColors1),
+    knobs = [
+        Knob(1, "Whites", "Whites", (200, 200, 200)),
+        Knob(2, "Highlights", "Highlights", (160, 160, 160)),
+        Knob(3, "Shadows", "Shadows", (80, 80, 80)),
+        Knob(4, "Blacks", "Blacks", (30, 30, 30)),
+        Knob(5, "Temperature", "Temp"),
+        Knob(6, "Tint", "Tint"),
+        Knob(7, "Exposure", "Exposure"),
+        Knob(8, "Contrast", "Contrast"),
+    ],
+    groups = [
+        KnobGroup(1, 4),
+        KnobGroup(5, 6, "WB"),
+    ],
+    series = 2,
+    actions = ["RevealPanelAdjust"],
+    panels = ["adjustPanel"])
+
+kProfilePresence = Profile("Presence", NavState(3, 2, kNavColors1),
+    knobs = [
+        Knob(1, "Texture", "Texture"),
+        Knob(2, "Clarity", "Clarity"),
+        Knob(3, "Dehaze", "Dehaze"),
+        Knob(4, "Vibrance", "Vibrance"),
+        Knob(5, "Saturation", "Saturation"),
+    ],
+    series = 3,
+    actions = ["RevealPanelAdjust"])
+
+kProfileGradient = Profile("Gradient", NavState(3, 3, kNavColors1),
+    knobs = [
+        Knob(1, "local_Exposure", "Exposure"),
+        Knob(2, "local_Contrast", "Contrast"),
+        Knob(3, "local_Highlights", "Highlights"),
+        Knob(4, "local_Shadows", "Shadows"),
+        Knob(5, "local_Whites2012", "Whites"),
+        Knob(6, "local_Blacks2012", "Blacks"),
+        Knob(7, "local_Clarity", "Clarity"),
+        Knob(8, "local_Dehaze", "Dehaze"),
+
+        Knob(1, "local_Temperature", layers="B"),
+        Knob(2, "local_Tint", layers="B"),
+        # local_Vibrance does not exist
+        Knob(4, "local_Saturation", layers="B"),
+        Knob(5, "local_Sharpness", layers="B"),
+        Knob(6, "local_LuminanceNoise", layers="B"),
+        Knob(7, "local_Moire", layers="B"),
+        Knob(8, "local_Defringe", layers="B"),
+    ],
+    buttons = [
+        Button(1, 6, "EnableGradientBasedCorrections", "On/Off", "AB"),
+    ],
+    panels = ["gradient"])
+
+kProfileBrush = derive_profile(kProfileGradient, "Brush", NavState(3, 4, kNavColors1),
+    knobs = [
+        Knob(7, "ChangeFeatherSize", layers="B"),
+        Knob(8, "ChangeBrushSize", layers="B"),
+    ],
+    buttons = [
+        Button(1, 6, "EnablePaintBasedCorrections", "On/Off", "AB"),
+    ],
+    panels = ["localized"])
+
+kProfileToneCurve = Profile("ToneCurve", NavState(3, 5, kNavColors1),
+    knobs = [
+        Knob(1, "ParametricHighlights", "Highlights", (200, 200, 200)),
+        Knob(2, "ParametricLights", "Lights", (160, 160, 160)),
+        Knob(3, "ParametricDarks", "Darks", (80, 80, 80)),
+        Knob(4, "ParametricShadows", "Shadows", (30, 30, 30)),
+        Knob(5, "ParametricHighlightSplit", "Split High", (160, 160, 160)),
+        Knob(6, "ParametricMidtoneSplit", "Split Mid", (80, 80, 80)),
+        Knob(7, "ParametricShadowSplit", "Split Low", (30, 30, 30)),
+    ],
+    groups = [
+        KnobGroup(1, 4),
+        KnobGroup(5, 7),
+    ],
+    buttons = [
+        Button(1, 6, "EnableToneCurve", "On/Off", "AB"),
+    ],
+    panels = ["tonePanel"])
 
 # Colors 2 Profiles
 
-def write_profile_colors_hue ():
-
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
-
-    with open("Colors-Hue.xml", "w") as outFile:
-        write_header(outFile)
-
-        write_submenu_setup(1, outFile)
-        write_global_nav_setup(4, outFile)
-
-        write_knob_a(1, "HueAdjustmentRed", "Red", p, outFile, QColor(200,0,0))
-        write_knob_a(2, "HueAdjustmentOrange", "Orange", p, outFile, QColor(200,100,0))
-        write_knob_a(3, "HueAdjustmentYellow", "Yellow", p, outFile, QColor(220,200,32))
-        write_knob_a(4, "HueAdjustmentGreen", "Green", p, outFile, QColor(0, 200, 0))
-        write_knob_a(5, "HueAdjustmentAqua", "Aqua", p, outFile, QColor(0, 200, 200))
-        write_knob_a(6, "HueAdjustmentBlue", "Blue", p, outFile, QColor(0, 0, 200))
-        write_knob_a(7, "HueAdjustmentPurple", "Purple", p, outFile, QColor(120, 0, 240))
-        write_knob_a(8, "HueAdjustmentMagenta", "Magenta", p, outFile, QColor(190, 0, 210))
-
-        write_button_upper_ab(6, "EnableColorAdjustments", "On/Off", p, outFile)
-
-        write_nav_colors_2(1, p, outFile)
-        write_global_nav_keys(4, p, outFile)
-
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Colors-Hue.png")
-
-def write_profile_colors_saturation ():
-
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
-
-    with open("Colors-Saturation.xml", "w") as outFile:
-        write_header(outFile)
-
-        write_submenu_setup(2, outFile)
-        write_global_nav_setup(4, outFile)
-
-        write_knob_a(1, "SaturationAdjustmentRed", "Red", p, outFile, QColor(200,0,0))
-        write_knob_a(2, "SaturationAdjustmentOrange", "Orange", p, outFile, QColor(200,100,0))
-        write_knob_a(3, "SaturationAdjustmentYellow", "Yellow", p, outFile, QColor(220,200,32))
-        write_knob_a(4, "SaturationAdjustmentGreen", "Green", p, outFile, QColor(0, 200, 0))
-        write_knob_a(5, "SaturationAdjustmentAqua", "Aqua", p, outFile, QColor(0, 200, 200))
-        write_knob_a(6, "SaturationAdjustmentBlue", "Blue", p, outFile, QColor(0, 0, 200))
-        write_knob_a(7, "SaturationAdjustmentPurple", "Purple", p, outFile, QColor(120, 0, 240))
-        write_knob_a(8, "SaturationAdjustmentMagenta", "Magenta", p, outFile, QColor(190, 0, 210))
-
-        write_button_upper_ab(6, "EnableColorAdjustments", "On/Off", p, outFile)
-
-        write_nav_colors_2(2, p, outFile)
-        write_global_nav_keys(4, p, outFile)
-
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Colors-Saturation.png")
-
-def write_profile_colors_luminance ():
-
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
-
-    with open("Colors-Luminance.xml", "w") as outFile:
-        write_header(outFile)
-
-        write_submenu_setup(3, outFile)
-        write_global_nav_setup(4, outFile)
-
-        write_knob_a(1, "LuminanceAdjustmentRed", "Red", p, outFile, QColor(200,0,0))
-        write_knob_a(2, "LuminanceAdjustmentOrange", "Orange", p, outFile, QColor(200,100,0))
-        write_knob_a(3, "LuminanceAdjustmentYellow", "Yellow", p, outFile, QColor(220,200,32))
-        write_knob_a(4, "LuminanceAdjustmentGreen", "Green", p, outFile, QColor(0, 200, 0))
-        write_knob_a(5, "LuminanceAdjustmentAqua", "Aqua", p, outFile, QColor(0, 200, 200))
-        write_knob_a(6, "LuminanceAdjustmentBlue", "Blue", p, outFile, QColor(0, 0, 200))
-        write_knob_a(7, "LuminanceAdjustmentPurple", "Purple", p, outFile, QColor(120, 0, 240))
-        write_knob_a(8, "LuminanceAdjustmentMagenta", "Magenta", p, outFile, QColor(190, 0, 210))
-
-        write_button_upper_ab(6, "EnableColorAdjustments", "On/Off", p, outFile)
-
-        write_nav_colors_2(3, p, outFile)
-        write_global_nav_keys(4, p, outFile)
-
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Colors-Luminance.png")
-
-def write_profile_colors_gray ():
-
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
-
-    with open("Grayscale.xml", "w") as outFile:
-        write_header(outFile)
-
-        write_submenu_setup(0, outFile)
-        write_global_nav_setup(5, outFile)
-
-        write_knob_a(1, "GrayMixerRed", "Red", p, outFile, QColor(200,0,0))
-        write_knob_a(2, "GrayMixerOrange", "Orange", p, outFile, QColor(200,100,0))
-        write_knob_a(3, "GrayMixerYellow", "Yellow", p, outFile, QColor(220,200,32))
-        write_knob_a(4, "GrayMixerGreen", "Green", p, outFile, QColor(0, 200, 0))
-        write_knob_a(5, "GrayMixerAqua", "Aqua", p, outFile, QColor(0, 200, 200))
-        write_knob_a(6, "GrayMixerBlue", "Blue", p, outFile, QColor(0, 0, 200))
-        write_knob_a(7, "GrayMixerPurple", "Purple", p, outFile, QColor(120, 0, 240))
-        write_knob_a(8, "GrayMixerMagenta", "Magenta", p, outFile, QColor(190, 0, 210))
-
-        for k in range(1, 7):
-            draw_cheat_button(p, 1, k, "")
-
-        write_button_upper_ab(6, "EnableGrayscaleMix", "On/Off", p, outFile)
-
-        write_global_nav_keys(5, p, outFile)
-
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Grayscale.png")
+# The color mixer knobs of one adjustment: param mixer is the command prefix.
+#
+kFamilyColorMixer = Profile("Color Mixer", NavState(4, 0, kNavColors2),
+    knobs = [
+        Knob(1, "${mixer}Red", "Red", (200, 0, 0)),
+        Knob(2, "${mixer}Orange", "Orange", (200, 100, 0)),
+        Knob(3, "${mixer}Yellow", "Yellow", (220, 200, 32)),
+        Knob(4, "${mixer}Green", "Green", (0, 200, 0)),
+        Knob(5, "${mixer}Aqua", "Aqua", (0, 200, 200)),
+        Knob(6, "${mixer}Blue", "Blue", (0, 0, 200)),
+        Knob(7, "${mixer}Purple", "Purple", (120, 0, 240)),
+        Knob(8, "${mixer}Magenta", "Magenta", (190, 0, 210)),
+    ],
+    buttons = [
+        Button(1, 6, "EnableColorAdjustments", "On/Off", "AB"),
+    ],
+    actions = ["RevealPanelMixer", "SetTreatmentColor"])
+
+kProfileColorsHue = derive_profile(kFamilyColorMixer, "Colors-Hue", NavState(4, 1, kNavColors2),
+    series = 5,
+    panels = ["mixerPanel"],
+    params = {"mixer": "HueAdjustment"})
+
+kProfileColorsSaturation = derive_profile(kFamilyColorMixer, "Colors-Saturation", NavState(4, 2, kNavColors2),
+    series = 6,
+    params = {"mixer": "SaturationAdjustment"})
+
+kProfileColorsLuminance = derive_profile(kFamilyColorMixer, "Colors-Luminance", NavState(4, 3, kNavColors2),
+    series = 7,
+    params = {"mixer": "LuminanceAdjustment"})
+
+kProfileColorsGray = derive_profile(kFamilyColorMixer, "Grayscale", NavState(5),
+    buttons = [
+        Button(1, 6, "EnableGrayscaleMix", "On/Off", "AB"),
+    ],
+    series = 8,
+    actions = ["RevealPanelMixer", "SetTreatmentBW"],
+    params = {"mixer": "GrayMixer"})
 
 # Effects Profile
 
-def write_profile_effects ():
-
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
-
-    with open("Effects.xml", "w") as outFile:
-        write_header(outFile)
-
-        write_submenu_setup(1, outFile)
-        write_global_nav_setup(6, outFile)
-
-        colVig = QColor(120, 120, 120)
-        colGrn = QColor(80, 80, 80)
-
-        write_knob_a(1, "PostCropVignetteAmount", "Amount", p, outFile, colVig)
-        write_knob_a(2, "PostCropVignetteMidpoint", "Midpoint", p, outFile, colVig)
-        write_knob_a(3, "PostCropVignetteRoundness", "Roundness", p, outFile, colVig)
-        write_knob_a(4, "PostCropVignetteFeather", "Feather", p, outFile, colVig)
-        draw_cheat_knob_group(p, 1, 4, "Vignette")
-        write_knob_a(5, "GrainAmount", "Amount", p, outFile, colGrn)
-        write_knob_a(6, "GrainSize", "Size", p, outFile, colGrn)
-        write_knob_a(7, "GrainFrequency", "Frequency", p, outFile, colGrn)
-        draw_cheat_knob_group(p, 5, 7, "Grain")
-        draw_cheat_knob(p, 8, "")
-
-        write_button_upper_ab(6, "EnableEffects", "On/Off", p, outFile)
-
-        write_nav_enhance(1, p, outFile)
-        write_global_nav_keys(6, p, outFile)
-
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Effects.png")
-
-def write_profile_detail ():
-
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
-
-    with open("Detail.xml", "w") as outFile:
-        write_header(outFile)
-
-        write_submenu_setup(2, outFile)
-        write_global_nav_setup(6, outFile)
-
-        colShp = QColor(120, 120, 120)
-        colLum = QColor(80, 80, 80)
-
-        write_knob_a(1, "Sharpness", "Sharpness", p, outFile, colShp)
-        write_knob_a(2, "SharpenRadius", "Radius", p, outFile, colShp)
-        write_knob_a(3, "SharpenDetail", "Detail", p, outFile, colShp)
-        write_knob_a(4, "SharpenEdgeMasking", "Edge", p, outFile, colShp)
-        draw_cheat_knob_group(p, 1, 4, "Sharpen")
-        write_knob_a(5, "LuminanceSmoothing", "Smoothing", p, outFile, colLum)
-        write_knob_a(6, "LuminanceNoiseReductionDetail", "Noise Det", p, outFile, colLum)
-        write_knob_a(7, "LuminanceNoiseReductionContrast", "Noise Cont", p, outFile, colLum)
-        draw_cheat_knob_group(p, 5, 7, "Luminance")
-        draw_cheat_knob(p, 8, "")
-
-        write_button_upper_ab(6, "EnableDetail", "On/Off", p, outFile)
-
-        write_nav_enhance(2, p, outFile)
-        write_global_nav_keys(6, p, outFile)
+kProfileEffects = Profile("Effects", NavState(6, 1, kNavEnhance),
+    knobs = [
+        Knob(1, "PostCropVignetteAmount", "Amount", (120, 120, 120)),
+        Knob(2, "PostCropVignetteMidpoint", "Midpoint", (120, 120, 120)),
+        Knob(3, "PostCropVignetteRoundness", "Roundness", (120, 120, 120)),
+        Knob(4, "PostCropVignetteFeather", "Feather", (120, 120, 120)),
+        Knob(5, "GrainAmount", "Amount", (80, 80, 80)),
+        Knob(6, "GrainSize", "Size", (80, 80, 80)),
+        Knob(7, "GrainFrequency", "Frequency", (80, 80, 80)),
+    ],
+    groups = [
+        KnobGroup(1, 4, "Vignette"),
+        KnobGroup(5, 7, "Grain"),
+    ],
+    buttons = [
+        Button(1, 6, "EnableEffects", "On/Off", "AB"),
+    ],
+    panels = ["effectsPanel"])
+
+kProfileDetail = Profile("Detail", NavState(6, 2, kNavEnhance),
+    knobs = [
+        Knob(1, "Sharpness", "Sharpness", (120, 120, 120)),
+        Knob(2, "SharpenRadius", "Radius", (120, 120, 120)),
+        Knob(3, "SharpenDetail", "Detail", (120, 120, 120)),
+        Knob(4, "SharpenEdgeMasking", "Edge", (120, 120, 120)),
+        Knob(5, "LuminanceSmoothing", "Smoothing", (80, 80, 80)),
+        Knob(6, "LuminanceNoiseReductionDetail", "Noise Det", (80, 80, 80)),
+        Knob(7, "LuminanceNoiseReductionContrast", "Noise Cont", (80, 80, 80)),
+    ],
+    groups = [
+        KnobGroup(1, 4, "Sharpen"),
+        KnobGroup(5, 7, "Luminance"),
+    ],
+    buttons = [
+        Button(1, 6, "EnableDetail", "On/Off", "AB"),
+    ],
+    panels = ["detailPanel"])
+
+# Grading Profiles
+
+kProfileGradingMid = Profile("Grading-Mid", NavState(7, 1, kNavGrading),
+    knobs = [
+        Knob(1, "ColorGradeMidtoneHue", "Hue", (60, 60, 60)),
+        Knob(2, "ColorGradeMidtoneSat", "Saturation", (60, 60, 60)),
+        Knob(3, "ColorGradeMidtoneLum", "Luminance", (60, 60, 60)),
+        Knob(4, "ColorGradeBlending", "Blending"),
+        Knob(5, "SplitToningBalance", "Balance"),
+    ],
+    groups = [
+        KnobGroup(1, 3),
+        KnobGroup(4, 5, "Global"),
+    ],
+    buttons = [
+        Button(1, 6, "EnableColorGrading", "On/Off", "AB"),
+    ],
+    series = 9,
+    actions = ["RevealPanelColorGrading", "ColorGrade3Way"],
+    panels = ["colorGradingPanel"])
+
+kProfileGradingHigh = derive_profile(kProfileGradingMid, "Grading-High", NavState(7, 2, kNavGrading),
+    knobs = [
+        Knob(1, "SplitToningHighlightHue"),
+        Knob(2, "SplitToningHighlightSaturation"),
+        Knob(3, "ColorGradeHighlightLum"),
+    ],
+    series = 10,
+    panels = [])
+
+kProfileGradingShadow = derive_profile(kProfileGradingMid, "Grading-Shadow", NavState(7, 3, kNavGrading),
+    knobs = [
+        Knob(1, "SplitToningShadowHue"),
+        Knob(2, "SplitToningShadowSaturation"),
+        Knob(3, "ColorGradeShadowLum"),
+    ],
+    series = 11,
+    panels = [])
+
+kProfileGradingGlobal = derive_profile(kProfileGradingMid, "Grading-Global", NavState(7, 4, kNavGrading),
+    knobs = [
+        Knob(1, "ColorGradeGlobalHue"),
+        Knob(2, "ColorGradeGlobalSat"),
+        Knob(3, "ColorGradeGlobalLum"),
+    ],
+    series = 12,
+    actions = ["RevealPanelColorGrading", "ColorGradeGlobal"],
+    panels = [])
+
+# All built-in profiles in build order.
+#
+kProfiles = [
+    kProfileLibrary,
+    kProfileCrop,
+    kProfileTransform,
+    kProfileLens,
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Detail.png")
+    kProfileTone,
+    kProfilePresence,
+    kProfileGradient,
+    kProfileBrush,
+    kProfileToneCurve,
 
+    kProfileColorsHue,
+    kProfileColorsSaturation,
+    kProfileColorsLuminance,
 
-def write_profile_grading_mid ():
+    kProfileColorsGray,
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+    kProfileEffects,
+    kProfileDetail,
 
-    with open("Grading-Mid.xml", "w") as outFile:
-        write_header(outFile)
+    kProfileGradingMid,
+    kProfileGradingHigh,
+    kProfileGradingShadow,
+    kProfileGradingGlobal,
+]
 
-        write_submenu_setup(1, outFile)
-        write_global_nav_setup(7, outFile)
 
-        write_knob_a(1, "ColorGradeMidtoneHue", "Hue", p, outFile, QColor(60, 60, 60))
-        write_knob_a(2, "ColorGradeMidtoneSat", "Saturation", p, outFile, QColor(60, 60, 60))
-        write_knob_a(3, "ColorGradeMidtoneLum", "Luminance", p, outFile, QColor(60, 60, 60))
-        draw_cheat_knob_group(p, 1, 3, "")
-        write_knob_a(4, "ColorGradeBlending", "Blending", p, outFile)
-        write_knob_a(5, "SplitToningBalance", "Balance", p, outFile)
-        draw_cheat_knob_group(p, 4, 5, "Global")
-        for k in range(6,9):
-            draw_cheat_knob(p, k, "")
+###############################################################################
+#
+# Validation
+#
+# The generated XML of every profile is checked against the address table:
+# each setting must address a control of the X-Touch Mini, at most once per
+# profile, and lit LEDs must belong to a bound button. Commands are checked
+# against the command catalogue (midi2lr_commands). Problems are returned
+# as Diagnostic records rather than raised, so a whole batch of profiles is
+# checked in one pass.
+#
+###############################################################################
 
-        write_button_upper_ab(6, "EnableColorGrading", "On/Off", p, outFile)
+# Settings and setups as written by write_profile_xml(), and in general.
+kXmlFastRe      = re.compile(r"<(setting|setup) channel=\"(\d+)\" (controller|note)=\"(\d+)\" (?:command_string|value)=\"([^\"]*)\"/>")
+kXmlElementRe   = re.compile(r"<(setting|setup)\s([^>]*?)/?>")
+kXmlAttributeRe = re.compile(r"(\w+)=\"([^\"]*)\"")
 
-        write_nav_grading(1, p, outFile)
-        write_global_nav_keys(7, p, outFile)
+kError   = "error"
+kWarning = "warning"
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Grading-Mid.png")
+# A problem found in a profile.
+# severity  kError or kWarning
+# code      A short identifier of the check, e.g. "duplicate"
+# address   The (layer, control, row, index) of the control, or None
+# midi      The ("controller" or "note", channel, number) concerned, or None
+# suggestions   Known commands an unknown command may be a typo of
+#
+class Diagnostic:
+    __slots__ = ("profile", "severity", "code", "message", "address", "midi", "suggestions")
+
+    def __init__ (self, profile, severity, code, message, address=None, midi=None, suggestions=None):
+        self.profile     = profile
+        self.severity    = severity
+        self.code        = code
+        self.message     = message
+        self.address     = address
+        self.midi        = midi
+        self.suggestions = suggestions
+
+    def to_dict (self):
+        d = {"profile": self.profile, "severity": self.severity, "code": self.code, "message": self.message}
+        if (self.address != None):
+            d["layer"], d["control"], d["row"], d["index"] = self.address
+        if (self.midi != None):
+            d["type"], d["channel"], d["number"] = self.midi
+        if (self.suggestions):
+            d["suggestions"] = list(self.suggestions)
+        return d
+
+    def __str__ (self):
+        return self.profile+": "+self.severity+": "+self.message+" ["+self.code+"]"
+
+# Map (type, channel, number) back to (layer, control, row, index), where type
+# is "controller" or "note" and channel and number are strings, as in the XML.
+#
+def reverse_address_map (addresses):
+    reverse = {}
+    for address, (channel, number) in addresses.items():
+        midiType = "controller" if address[1] == kKnob else "note"
+        reverse[(midiType, str(channel), str(number))] = address
+    return reverse
+
+def describe_address (address):
+    layer, control, row, index = address
+    if (row == 0):
+        return "layer "+layer+" "+control+" "+str(index)
+    return "layer "+layer+" "+control+" "+str(row)+"/"+str(index)
+
+# The settings and setups of an XML profile as (element, channel, type,
+# number, command or value) tuples of strings. channel and number are None
+# when missing.
+#
+def xml_elements (xml):
+    elements = kXmlFastRe.findall(xml)
+    if (len(elements) == xml.count("<setting ")+xml.count("<setup ")):
+        return elements
+
+    elements = []
+    for element, attributes in kXmlElementRe.findall(xml):
+        attrs = dict(kXmlAttributeRe.findall(attributes))
+        midiType = "controller" if "controller" in attrs else "note"
+        value = attrs.get("command_string", "") if element == "setting" else attrs.get("value", "0")
+        elements.append((element, attrs.get("channel"), midiType, attrs.get(midiType), value))
+    return elements
+
+# Diagnose a setting or setup whose (type, channel, number) is not in the
+# address table.
+#
+def diagnose_midi (name, element, command, key):
+    midiType, channel, number = key
+    try:
+        midi = (midiType, int(channel), int(number))
+    except (TypeError, ValueError):
+        return Diagnostic(name, kError, "malformed", element+" without a valid channel or "+midiType)
+
+    if (not (1 <= midi[1] <= 16 and 0 <= midi[2] <= 127)):
+        return Diagnostic(name, kError, "out-of-range",
+            "%s channel %d, %s %d is out of range" % (element, midi[1], midiType, midi[2]), None, midi)
+    if (element == "setup"):
+        return Diagnostic(name, kWarning, "unbound-led",
+            "the LED of channel %d, note %d is lit but no control sends it" % midi[1:], None, midi)
+    return Diagnostic(name, kError, "unmapped",
+        "%s is assigned to channel %d, %s %d, which no control sends" % (command, midi[1], midiType, midi[2]), None, midi)
+
+def midi_of (key):
+    return (key[0], int(key[1]), int(key[2]))
+
+# Diagnose a command that is not in the catalogue, or that cannot be reset.
+#
+def diagnose_command (name, command, address=None, midi=None):
+    if (command == ""):
+        return Diagnostic(name, kError, "empty-command", "setting without a command", address, midi)
+    if (command[:5] == "Reset" and midi2lr_commands.is_known(command[5:])):
+        return Diagnostic(name, kError, "not-resettable",
+            "%s: %s cannot be reset" % (command, command[5:]), address, midi)
+    suggestions = midi2lr_commands.suggest(command)
+    message = "unknown command "+command
+    if (suggestions):
+        message += " (did you mean "+" or ".join(suggestions)+"?)"
+    return Diagnostic(name, kError, "unknown-command", message, address, midi, suggestions)
+
+# Check the XML text of one profile. reverse is the reverse address table.
+#
+# The common case of a clean profile is decided with set operations over all
+# of its settings; only a profile that fails them is checked setting by
+# setting to produce the diagnostics.
+#
+def validate_profile_xml (name, xml, reverse):
+    elements = xml_elements(xml)
+    settings = [(e[2], e[1], e[3]) for e in elements if e[0] == "setting"]
+    commands = [e[4] for e in elements if e[0] == "setting"]
+    lit      = [(e[2], e[1], e[3]) for e in elements if e[0] == "setup" and e[4] != "0"]
+
+    boundSet = set(settings)
+    if (len(boundSet) == len(settings) and boundSet.issubset(reverse.keys()) and boundSet.issuperset(lit)
+            and midi2lr_commands.kKnobCommands.issuperset(e[4] for e in elements if e[2] == "controller")
+            and midi2lr_commands.kButtonCommands.issuperset(e[4] for e in elements if e[0] == "setting" and e[2] == "note")):
+        return []
+
+    diagnostics = []
+    bound = {}
+    unknown = set()
+    for key, command in zip(settings, commands):
+        address = reverse.get(key)
+        midi = midi_of(key) if address != None else None
+        if (address == None):
+            diagnostics.append(diagnose_midi(name, "setting", command, key))
+        elif (key in bound):
+            diagnostics.append(Diagnostic(name, kError, "duplicate",
+                "%s is assigned to both %s and %s" % (describe_address(address), bound[key], command), address, midi))
+
+        # The reset of an unknown command is not reported again.
+        info = midi2lr_commands.command_info(command)
+        if (info == None):
+            unknown.add(command)
+            if (not (command[:5] == "Reset" and command[5:] in unknown)):
+                diagnostics.append(diagnose_command(name, command, address, midi))
+        elif (key[0] == "controller" and info[0] == midi2lr_commands.kTypeButton):
+            diagnostics.append(Diagnostic(name, kWarning, "command-type",
+                "%s is a button command but assigned to a knob" % command, address, midi))
+        elif (key[0] == "note" and info[0] != midi2lr_commands.kTypeButton):
+            diagnostics.append(Diagnostic(name, kWarning, "command-type",
+                "%s is not a button command but assigned to a button" % command, address, midi))
+        bound.setdefault(key, command)
+
+    # Dark LEDs may be cleared without a command; lit ones need a button.
+    for key in lit:
+        address = reverse.get(key)
+        if (address == None):
+            diagnostics.append(diagnose_midi(name, "setup", "", key))
+        elif (key not in bound):
+            diagnostics.append(Diagnostic(name, kWarning, "unbound-led",
+                "the LED of %s is lit but the button has no command" % describe_address(address), address, midi_of(key)))
+
+    return diagnostics
+
+# The knobs and buttons of a profile, including the navigation, that have no
+# address in addresses, as (address, command) pairs. The XML leaves them out
+# (see write_knob).
+#
+def missing_controls (profile, addresses):
+    missing = []
+    for knob in profile.knobs:
+        for layer in knob.layers:
+            if ((layer, kKnob, 0, knob.index) not in addresses):
+                missing.append(((layer, kKnob, 0, knob.index), knob.command))
+    for button in profile_buttons(profile):
+        for layer in button.layers:
+            if ((layer, kButton, button.row, button.index) not in addresses):
+                missing.append(((layer, kButton, button.row, button.index), button.command))
+    return missing
+
+# Validate the generated XML of all profiles, and that every control of the
+# profiles exists. Returns a list of Diagnostics.
+#
+def validate_profiles (profiles, addresses=None):
+    addresses = addresses or kAddressMap
+    reverse = reverse_address_map(addresses)
+    diagnostics = []
+    for profile in profiles:
+        for address, command in missing_controls(profile, addresses):
+            diagnostics.append(Diagnostic(profile.name, kError, "no-control",
+                "%s is assigned to %s, which does not exist" % (command, describe_address(address)), address))
+
+        outFile = io.StringIO()
+        write_profile_xml(profile, outFile, addresses)
+        diagnostics.extend(validate_profile_xml(profile.name, outFile.getvalue(), reverse))
+        for command in profile.actions:
+            if (not midi2lr_commands.is_known(command)):
+                diagnostics.append(diagnose_command(profile.name, command))
+    return diagnostics
 
 
-def write_profile_grading_high ():
+###############################################################################
+#
+# Profile import
+#
+# Reads MIDI2LR XML profiles back into Profiles, e.g. hand edited or third
+# party ones. The settings are streamed with iterparse and dropped as soon
+# as they are read, so memory use does not grow with the file. Each setting is
+# placed by the reverse address table; what the model cannot hold (settings
+# of unknown controls, knob pushes that don't reset the knob) is reported as
+# Diagnostics.
+#
+###############################################################################
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+# The settings and setups of an XML profile as (element, attributes) pairs,
+# read from source (a file name or file object) one at a time.
+#
+def iter_xml_settings (source):
+    from xml.etree import ElementTree
+
+    root = None
+    for event, elem in ElementTree.iterparse(source, ("start", "end")):
+        if (root == None):
+            root = elem
+        elif (event == "end" and elem.tag in ("setting", "setup")):
+            yield elem.tag, elem.attrib
+            root.clear()
+
+# The navigation block whose buttons are all among buttons, a dict of (row,
+# index, command) -> layers. The largest one wins.
+#
+def find_nav_block (buttons, blocks):
+    found = None
+    for block in blocks:
+        if (all(set(b.layers) <= set(buttons.get((b.row, b.index, b.command), "")) for b in block.buttons)):
+            if (found == None or len(block.buttons) > len(found.buttons)):
+                found = block
+    return found
+
+# Read the XML profile source into a Profile called name. reverse is the
+# reverse address table (see reverse_address_map). Returns the Profile and a
+# list of Diagnostics.
+#
+# With navigation the buttons of the global navigation and of a navigation
+# block in kNavBlocks become the profile's navigation. Without it all
+# buttons stay the profile's own, as for profiles that were not made by this
+# generator (see draw_imported_profile). Either way the lit LEDs of layer A
+# are the menu and submenu. Layers assigning the same command to a control
+# are merged.
+#
+def import_profile_xml (source, name, reverse, navigation=True):
+    knobs   = {}   # (index, command) -> layers
+    pushes  = {}   # (layer, index) -> command
+    buttons = {}   # (row, index, command) -> layers
+    lit     = {}   # row -> index
+    bound   = set()
+    diagnostics = []
+
+    for element, attrs in iter_xml_settings(source):
+        midiType = "controller" if "controller" in attrs else "note"
+        key = (midiType, attrs.get("channel"), attrs.get(midiType))
+        command = attrs.get("command_string", "")
+        value = attrs.get("value", "0")
+        address = reverse.get(key)
+        if (address == None):
+            if (element == "setting" or value != "0"):
+                diagnostics.append(diagnose_midi(name, element, command, key))
+            continue
+
+        layer, control, row, index = address
+        if (element == "setup"):
+            if (value != "0" and layer == "A"):
+                lit[row] = index
+        elif (key in bound):
+            diagnostics.append(Diagnostic(name, kWarning, "duplicate",
+                "%s is assigned twice, %s is not imported" % (describe_address(address), command), address, midi_of(key)))
+        else:
+            bound.add(key)
+            if (control == kKnob):
+                knobs[(index, command)] = knobs.get((index, command), "")+layer
+            elif (control == kKnobPush):
+                pushes[(layer, index)] = command
+            else:
+                buttons[(row, index, command)] = buttons.get((row, index, command), "")+layer
+
+    # Knob pushes are implied by the knob command.
+    for (layer, index), command in pushes.items():
+        if (not any(i == index and layer in layers and command == "Reset"+c for (i, c), layers in knobs.items())):
+            address = (layer, kKnobPush, 0, index)
+            diagnostics.append(Diagnostic(name, kWarning, "push-command",
+                "%s runs %s, only resets of the knob are imported" % (describe_address(address), command), address))
+
+    navButtons = []
+    block = find_nav_block(buttons, kNavBlocks.values()) if navigation else None
+    if (block != None):
+        navButtons.extend(block.buttons)
+    if (navigation):
+        if (find_nav_block(buttons, [kNavGlobal]) != None):
+            navButtons.extend(kNavGlobal.buttons)
+        else:
+            diagnostics.append(Diagnostic(name, kWarning, "global-nav",
+                "the global navigation is not assigned, building the profile adds it"))
+    for button in navButtons:
+        key = (button.row, button.index, button.command)
+        layers = "".join(l for l in buttons[key] if l not in button.layers)
+        if (layers != ""):
+            buttons[key] = layers
+        else:
+            del buttons[key]
+
+    nav = NavState(lit.get(2, 0), lit.get(1, 0) if (block != None or not navigation) else 0, block)
+    return (Profile(name, nav,
+                    [Knob(index, command, layers=layers) for (index, command), layers in sorted(knobs.items())],
+                    [Button(row, index, command, layers=layers) for (row, index, command), layers in sorted(buttons.items())]),
+            diagnostics)
+
+# Import the XML profile fileName, or every XML profile in the directory
+# fileName, using addresses (see import_profile_xml for navigation). Files
+# that are not well-formed XML are skipped with an error. Returns the
+# Profiles and a list of Diagnostics.
+#
+def import_profiles (fileName, addresses=None, navigation=True):
+    from xml.etree import ElementTree
+
+    fileNames = [fileName]
+    if (os.path.isdir(fileName)):
+        fileNames = [os.path.join(fileName, f) for f in sorted(os.listdir(fileName)) if f.lower().endswith(".xml")]
+
+    reverse = reverse_address_map(addresses or kAddressMap)
+    profiles = []
+    diagnostics = []
+    for name in fileNames:
+        profileName = os.path.splitext(os.path.basename(name))[0]
+        try:
+            profile, found = import_profile_xml(name, profileName, reverse, navigation)
+        except ElementTree.ParseError as e:
+            diagnostics.append(Diagnostic(profileName, kError, "malformed", "not a MIDI2LR profile: "+str(e)))
+            continue
+        profiles.append(profile)
+        diagnostics.extend(found)
+    return profiles, diagnostics
 
-    with open("Grading-High.xml", "w") as outFile:
-        write_header(outFile)
 
-        write_submenu_setup(2, outFile)
-        write_global_nav_setup(7, outFile)
+###############################################################################
+#
+# Instrumentation
+#
+# While timingEnabled is set, timed_phase() records each build phase as an
+# event (phase, profile name, process id, start, duration). Times are in
+# microseconds of the perf_counter clock, which all processes of a build
+# share. Events of process wide phases (Qt start-up) have no profile name.
+#
+###############################################################################
 
-        write_knob_a(1, "SplitToningHighlightHue", "Hue", p, outFile, QColor(60, 60, 60))
-        write_knob_a(2, "SplitToningHighlightSaturation", "Saturation", p, outFile, QColor(60, 60, 60))
-        write_knob_a(3, "ColorGradeHighlightLum", "Luminance", p, outFile, QColor(60, 60, 60))
-        draw_cheat_knob_group(p, 1, 3, "")
-        write_knob_a(4, "ColorGradeBlending", "Blending", p, outFile)
-        write_knob_a(5, "SplitToningBalance", "Balance", p, outFile)
-        draw_cheat_knob_group(p, 4, 5, "Global")
-        for k in range(6,9):
-            draw_cheat_knob(p, k, "")
+kProfilePhases = ["xml", "layout", "init-image", "init-painting", "draw", "encode"]
 
-        write_button_upper_ab(6, "EnableColorGrading", "On/Off", p, outFile)
+timingEnabled = False
+timingEvents = []
 
-        write_nav_grading(2, p, outFile)
-        write_global_nav_keys(7, p, outFile)
+@contextlib.contextmanager
+def timed_phase (phase, profileName=""):
+    if (not timingEnabled):
+        yield
+        return
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Grading-High.png")
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        timingEvents.append((phase, profileName, os.getpid(), start*1e6, (end-start)*1e6))
 
+def take_timing_events ():
+    global timingEvents
+    events, timingEvents = timingEvents, []
+    return events
 
-def write_profile_grading_shadow ():
+# Print the time of each phase per profile in milliseconds, followed by the
+# process wide phases.
+#
+def print_timings (events):
+    profiles = {}
+    processes = {}
+    for phase, name, pid, start, duration in events:
+        if (name != ""):
+            phases = profiles.setdefault(name, {})
+            phases[phase] = phases.get(phase, 0)+duration
+        else:
+            processes.setdefault(pid, []).append((phase, duration))
+
+    columns = [ph for ph in kProfilePhases if any(ph in phases for phases in profiles.values())]
+    nameWidth = max([len(name) for name in profiles]+[7])
+
+    print(("%-"+str(nameWidth)+"s") % "profile" + "".join("%14s" % ph for ph in columns) + "%14s" % "total")
+    totals = dict((ph, 0) for ph in columns)
+    for name, phases in profiles.items():
+        row = ("%-"+str(nameWidth)+"s") % name
+        for ph in columns:
+            row += "%14.2f" % (phases.get(ph, 0)/1000)
+            totals[ph] += phases.get(ph, 0)
+        print(row + "%14.2f" % (sum(phases.values())/1000))
+    print(("%-"+str(nameWidth)+"s") % "total" + "".join("%14.2f" % (totals[ph]/1000) for ph in columns)
+          + "%14.2f" % (sum(totals.values())/1000))
+
+    for pid, phases in processes.items():
+        print("process "+str(pid)+": "+", ".join("%s %.2f ms" % (ph, duration/1000) for ph, duration in phases))
+
+# Write the events in the Chrome trace event format, for chrome://tracing or
+# https://ui.perfetto.dev.
+#
+def write_chrome_trace (events, fileName):
+    trace = []
+    for phase, name, pid, start, duration in events:
+        event = {"name": phase, "cat": "build", "ph": "X", "ts": start, "dur": duration, "pid": pid, "tid": pid}
+        if (name != ""):
+            event["args"] = {"profile": name}
+        trace.append(event)
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+    with open(fileName, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
 
-    with open("Grading-Shadow.xml", "w") as outFile:
-        write_header(outFile)
 
-        write_submenu_setup(3, outFile)
-        write_global_nav_setup(7, outFile)
+###############################################################################
+#
+# Build engine
+#
+###############################################################################
 
-        write_knob_a(1, "SplitToningShadowHue", "Hue", p, outFile, QColor(60, 60, 60))
-        write_knob_a(2, "SplitToningShadowSaturation", "Saturation", p, outFile, QColor(60, 60, 60))
-        write_knob_a(3, "ColorGradeShadowLum", "Luminance", p, outFile, QColor(60, 60, 60))
-        draw_cheat_knob_group(p, 1, 3, "")
-        write_knob_a(4, "ColorGradeBlending", "Blending", p, outFile)
-        write_knob_a(5, "SplitToningBalance", "Balance", p, outFile)
-        draw_cheat_knob_group(p, 4, 5, "Global")
-        for k in range(6,9):
-            draw_cheat_knob(p, k, "")
+# Options that apply to every profile of a build.
+# addresses The MIDI address table (see build_address_map)
+# atomic    Replace output files atomically (see write_output_file)
+# xmlOnly   Write the XML profiles only, without cheat images and without Qt
+# timings   Record the duration of each build phase (see timed_phase)
+# scales    The cheat image scales to write: numbers (1 - kImgW x kImgH) and "svg"
+# atlas     None, or write the cheat images as atlases instead of one image per
+#           profile: "all" in one atlas, "group" one per navigation group
+# encoding  The ImageEncoding of the cheat images
+# layerB    How the cheat images show layer B (see cheat_sheets)
+# device    The Device the profiles are built for; addresses are its map
+# outputDir The directory the outputs and the build cache go to ("" - the
+#           current directory)
+#
+class BuildOptions:
+    __slots__ = ("addresses", "atomic", "xmlOnly", "timings", "scales", "atlas", "encoding", "layerB", "device",
+                 "outputDir")
+
+    def __init__ (self, addresses=None, atomic=False, xmlOnly=False, timings=False, scales=(1,), atlas=None,
+                  encoding=None, layerB=None, device=None, outputDir=""):
+        if (isinstance(addresses, dict)):
+            addresses = types.MappingProxyType(addresses)
+        self.addresses = addresses or kAddressMap
+        self.atomic    = atomic
+        self.xmlOnly   = xmlOnly
+        self.timings   = timings
+        self.scales    = tuple(scales)
+        self.atlas     = atlas
+        self.encoding  = encoding or ImageEncoding()
+        self.device    = device or kDeviceXTouchMini
+        # There is nothing to show for a device without layer B.
+        self.layerB    = layerB if "B" in self.device.layout else None
+        self.outputDir = outputDir
+
+    # The read-only address table can't be pickled, pass it on to worker
+    # processes as a plain dict.
+    def __reduce__ (self):
+        return (BuildOptions, (dict(self.addresses), self.atomic, self.xmlOnly, self.timings, self.scales, self.atlas,
+                              self.encoding, self.layerB, self.device, self.outputDir))
+
+    # The path of an output file.
+    def path (self, fileName):
+        return os.path.join(self.outputDir, fileName)
+
+app = None
+
+# Create the QApplication and register the cheat image font. Called once in
+# the main process for serial builds and once in every worker process for
+# parallel builds.
+#
+def init_qt ():
+    global app
+    if (app == None):
+        with timed_phase("qt-import"):
+            import_qt()
+        with timed_phase("qt-application"):
+            app = QApplication(["-platform offscreen"])
+        with timed_phase("font-register"):
+            QFontDatabase.addApplicationFont(kFontFile)
+
+# Prepare a process for building profiles with the given options.
+#
+def init_worker (options):
+    global timingEnabled
+    timingEnabled = options.timings
+    if (not options.xmlOnly):
+        init_qt()
+        use_device(options.device)
+
+# What a profile job reports back to the build. events holds the timing
+# events recorded in the worker since its previous job, images the (file
+# name, size, seconds) of each encoded cheat image.
+#
+class JobResult:
+    __slots__ = ("name", "cacheHits", "cacheMisses", "events", "images")
+
+    def __init__ (self, name, cacheHits=0, cacheMisses=0, events=(), images=()):
+        self.name        = name
+        self.cacheHits   = cacheHits
+        self.cacheMisses = cacheMisses
+        self.events      = events
+        self.images      = images
+
+def run_profile_job (options, profile):
+    init_worker(options)
+    hits, misses = renderCacheStats["hits"], renderCacheStats["misses"]
+    images = write_profile(profile, options)
+    return JobResult(profile.name, renderCacheStats["hits"]-hits, renderCacheStats["misses"]-misses, take_timing_events(),
+                     images)
+
+# Build the given (options, profile) jobs with func, a function taking
+# (options, profile) and returning a JobResult (None - run_profile_job). With
+# numJobs > 1 the jobs are spread over a process pool, otherwise (or if no
+# pool can be created) they are built one after the other in this process.
+# Every profile renders with its own QImage/QPainter, so the output files are
+# identical either way. Yields the JobResult of each job in the order of jobs.
+#
+def run_profile_jobs (jobs, numJobs=1, func=None):
+    func = func or run_profile_job
+    if (numJobs > 1 and len(jobs) > 1):
+        from concurrent.futures import ProcessPoolExecutor
+        try:
+            pool = ProcessPoolExecutor(max_workers=min(numJobs, len(jobs)), initializer=init_worker,
+                                       initargs=(jobs[0][0],))
+        except (OSError, NotImplementedError) as e:
+            print("Process pool unavailable ("+str(e)+"), building serially.", file=sys.stderr)
+        else:
+            with pool:
+                yield from pool.map(func, *zip(*jobs))
+            return
+
+    for options, profile in jobs:
+        yield func(options, profile)
+
+# Render the cheat images of a profile imported without navigation at the
+# scales of options, layer A only. The profile is laid out once, as in
+# write_profile, and drawn on the bare template.
+#
+def render_profile_job (options, profile):
+    init_worker(options)
+    hits, misses = renderCacheStats["hits"], renderCacheStats["misses"]
+
+    with timed_phase("layout", profile.name):
+        picture = QPicture()
+        p = QPainter(picture)
+        p.setRenderHint(QPainter.Antialiasing)
+        draw_imported_profile(profile, p)
+        p.end()
+
+    images = write_sheet_images(profile.name, "A", (), {"A": picture}, options, profile.name)
+    return JobResult(profile.name, renderCacheStats["hits"]-hits, renderCacheStats["misses"]-misses, take_timing_events(),
+                     images)
+
+# Render the cheat images of MIDI2LR XML profiles that were not made by this
+# generator: every XML profile in directory (or the single profile directory)
+# is imported without navigation and drawn as it is, knobs and buttons
+# without a label labeled from the command label table. Returns the
+# JobResults and the import Diagnostics.
+#
+def render_profiles (directory, options, numJobs=1):
+    profiles, diagnostics = import_profiles(directory, options.addresses, navigation=False)
+    jobs = [(options, profile) for profile in profiles]
+    return list(run_profile_jobs(jobs, numJobs, render_profile_job)), diagnostics
 
-        write_button_upper_ab(6, "EnableColorGrading", "On/Off", p, outFile)
 
-        write_nav_grading(3, p, outFile)
-        write_global_nav_keys(7, p, outFile)
+###############################################################################
+#
+# Build cache
+#
+# A profile is rebuilt only if its cache key changed or one of its outputs is
+# missing. The key covers the profile definition and the shared generator
+# code; the keys of the cheat images also cover what only they depend on: the
+# rendering constants, the font file, the labels and the image options. Keys
+# are stored per output file, so an XML-only build doesn't mark the cheat
+# images as up to date, and changing an image option doesn't rebuild the XML
+# of an XML-only build.
+#
+###############################################################################
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Grading-Shadow.png")
+# Bump when the output format changes in a way the hashed code doesn't show.
+kGeneratorVersion = "1"
+kCacheFile = ".midi2lr-cache.json"
 
-def write_profile_grading_global ():
+# Add the compiled form of a function to the hash h. Line numbers and comments
+# are not part of it, so reformatting or moving a function doesn't invalidate
+# the outputs. (Parsing the source with inspect would cost more than a whole
+# XML-only build.)
+#
+def hash_code (code, h):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if (isinstance(const, types.CodeType)):
+            hash_code(const, h)
+        else:
+            h.update(repr(const).encode())
+
+# Function-valued defaults are left out of the hash: their repr holds an
+# address that differs from process to process, and the code of functions in
+# this module is hashed anyway.
+#
+def hash_function (func, h):
+    hash_code(func.__code__, h)
+    defaults = func.__defaults__ or ()
+    h.update(repr(tuple(d for d in defaults if not callable(d))).encode())
+
+def hash_file (fileName):
+    try:
+        with open(fileName, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return "missing"
+
+# Key shared by all profiles: the generator code, the device, the MIDI
+# addresses and the global navigation.
+#
+def generator_key (options):
+    h = hashlib.sha256()
+    h.update(kGeneratorVersion.encode())
+    h.update(json.dumps(options.device.to_dict(), sort_keys=True).encode())
+    for name, obj in sorted(globals().items()):
+        if (getattr(obj, "__module__", None) != __name__):
+            continue
+        if (isinstance(obj, types.FunctionType)):
+            hash_function(obj, h)
+        elif (isinstance(obj, type)):
+            for attrName, attr in sorted(vars(obj).items()):
+                attr = getattr(attr, "__func__", attr)
+                if (isinstance(attr, types.FunctionType)):
+                    hash_function(attr, h)
+    h.update(repr(sorted(options.addresses.items())).encode())
+    h.update(json.dumps(kNavGlobal.to_dict(), sort_keys=True).encode())
+    h.update(repr((midi2lr_commands.kCatalogueVersion, midi2lr_commands.kCatalogueRevision)).encode())
+    h.update(repr(sorted(midi2lr_commands.kCommands.items())).encode())
+    return h.hexdigest()
+
+# Key shared by the cheat images of all profiles: genKey and what only the
+# images depend on.
+#
+def image_key (genKey, options):
+    h = hashlib.sha256(genKey.encode())
+    h.update(repr((kColorBg, kColorMd, kColorFg, kColorSl)).encode())
+    h.update(hash_file(kFontFile).encode())
+    h.update(repr(sorted(midi2lr_commands.kCommandLabels.items())).encode())
+    hash_function(midi2lr_commands.command_label, h)
+    h.update(json.dumps(options.encoding.to_dict(), sort_keys=True).encode())
+    h.update(repr(options.layerB).encode())
+    return h.hexdigest()
+
+# Key of a single profile: its normalized definition including the
+# sub-navigation block it shows.
+#
+def profile_key (profile, genKey):
+    d = profile.to_dict()
+    if (profile.nav.block != None):
+        d["nav"]["block"] = profile.nav.block.to_dict()
+    return hashlib.sha256((genKey+json.dumps(d, sort_keys=True)).encode()).hexdigest()
+
+def load_cache (outputDir=""):
+    try:
+        with open(os.path.join(outputDir, kCacheFile)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache (cache, outputDir=""):
+    with open(os.path.join(outputDir, kCacheFile), "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+
+# The cache key of each output file of a profile: the XML profile is keyed
+# by genKey, the cheat images by imageKey (see image_key).
+#
+def output_keys (profile, options, genKey, imageKey):
+    outputs = profile_outputs(profile, options)
+    keys = {outputs[0]: profile_key(profile, genKey)}
+    if (len(outputs) > 1):
+        key = profile_key(profile, imageKey)
+        keys.update((fileName, key) for fileName in outputs[1:])
+    return keys
+
+def outputs_up_to_date (keys, cache, options):
+    for fileName, key in keys.items():
+        if (cache.get(fileName) != key or not os.path.exists(options.path(fileName))):
+            return False
+    return True
+
+# Build all profiles whose cache key changed (or all of them with force) and
+# return the JobResults of the rebuilt profiles.
+#
+def build_profiles (profiles, options, numJobs=1, force=False):
+    return build_matrix([options], profiles, numJobs, force)[0]
 
-    img = init_cheat_image()
-    p   = init_cheat_painting(img)
+# Build the profiles for several targets, each with its own options (e.g. one
+# per device, see BuildOptions.device) and its own output directory and
+# cache. The stale (target, profile) combinations of all targets share one
+# process pool. Returns the JobResults of the rebuilt profiles per target.
+#
+def build_matrix (targets, profiles, numJobs=1, force=False):
+    caches = []
+    jobs = []
+    keys = []
+    for options in targets:
+        cache = {} if force else load_cache(options.outputDir)
+        genKey = generator_key(options)
+        imageKey = image_key(genKey, options)
+        caches.append(cache)
+        for profile in profiles:
+            outputKeys = output_keys(profile, options, genKey, imageKey)
+            if (not outputs_up_to_date(outputKeys, cache, options)):
+                for address, command in missing_controls(profile, options.addresses):
+                    print("%s: warning: %s has no %s, %s is left out" % (options.path(profile.name), options.device.title,
+                          describe_address(address), command), file=sys.stderr)
+                jobs.append((options, profile))
+                keys.append((len(caches)-1, outputKeys))
+
+    rebuilt = [[] for options in targets]
+    try:
+        for (options, profile), (target, outputKeys), result in zip(jobs, keys, run_profile_jobs(jobs, numJobs)):
+            caches[target].update(outputKeys)
+            rebuilt[target].append(result)
+    finally:
+        for options, cache, results in zip(targets, caches, rebuilt):
+            if (results):
+                save_cache(cache, options.outputDir)
+
+    return rebuilt
+
+
+# Write the atlases whose profiles changed (or all of them with force) and
+# the atlas index. Returns the file names of the written atlases. Atlases are
+# drawn in this process; SVG scales are not supported for atlases.
+#
+def build_atlases (profiles, options, force=False):
+    if (options.atlas == None or options.xmlOnly):
+        return []
+
+    init_worker(options)
+    cache = load_cache(options.outputDir)
+    imageKey = image_key(generator_key(options), options)
+
+    index = {"atlases": []}
+    written = []
+    try:
+        for name, group, members in atlas_groups(profiles, options.atlas):
+            h = hashlib.sha256()
+            for profile in members:
+                h.update(profile_key(profile, imageKey).encode())
+            key = h.hexdigest()
+
+            for scale in options.scales:
+                if (scale == "svg"):
+                    continue
+                fileName = atlas_image_name(name, scale, options.encoding.extension())
+                entry = cache.get(kAtlasIndexFile, {}).get(fileName)
+                if (not force and cache.get(fileName) == key and entry != None and os.path.exists(options.path(fileName))):
+                    index["atlases"].append(entry)
+                    continue
+
+                entry = write_atlas(name, group, members, scale, options)
+                index["atlases"].append(entry)
+                cache[fileName] = key
+                cache.setdefault(kAtlasIndexFile, {})[fileName] = entry
+                written.append(fileName)
+    finally:
+        # The index also changes when atlases go away, e.g. with no profiles.
+        indexData = json.dumps(index, indent=1)+"\n"
+        try:
+            with open(options.path(kAtlasIndexFile)) as f:
+                indexChanged = f.read() != indexData
+        except OSError:
+            indexChanged = True
+        if (written or indexChanged):
+            write_output_file(options.path(kAtlasIndexFile), indexData, options.atomic)
+        if (written):
+            save_cache(cache, options.outputDir)
+
+    return written
+
+# The build options for each of devices (Device objects): a device builds into
+# a directory named after it. Without devices the X-Touch Mini is built into
+# the current directory. channel overrides the devices' default channel,
+# settings are further BuildOptions.
+#
+def build_targets (devices=(), channel=None, **settings):
+    if (not devices):
+        return [BuildOptions(kDeviceXTouchMini.address_map(channel), **settings)]
+
+    targets = []
+    for device in devices:
+        if (any(t.device.name == device.name for t in targets)):
+            raise ValueError("Duplicate device name "+device.name)
+        os.makedirs(device.name, exist_ok=True)
+        targets.append(BuildOptions(device.address_map(channel), device=device, outputDir=device.name, **settings))
+    return targets
+
+# Build the profiles and atlases of every target. Returns (options, rebuilt,
+# atlases) per target.
+#
+def build_all (profiles, targets, numJobs=1, force=False):
+    rebuilt = build_matrix(targets, profiles, numJobs, force)
+    return [(options, results, build_atlases(profiles, options, force)) for options, results in zip(targets, rebuilt)]
 
-    with open("Grading-Global.xml", "w") as outFile:
-        write_header(outFile)
 
-        write_submenu_setup(4, outFile)
-        write_global_nav_setup(7, outFile)
+###############################################################################
+#
+# Watch mode
+#
+# Watches the profile spec, the generator sources and the font for changes.
+# A changed spec is reloaded and built in this process, where Qt, the font and
+# the render caches stay loaded, so only the profiles whose definition
+# changed are redrawn. A changed generator or font restarts the process; the
+# build cache still limits the rebuild to the affected profiles.
+#
+###############################################################################
 
-        write_knob_a(1, "ColorGradeGlobalHue", "Hue", p, outFile, QColor(60, 60, 60))
-        write_knob_a(2, "ColorGradeGlobalSat", "Saturation", p, outFile, QColor(60, 60, 60))
-        write_knob_a(3, "ColorGradeGlobalLum", "Luminance", p, outFile, QColor(60, 60, 60))
-        draw_cheat_knob_group(p, 1, 3, "")
-        write_knob_a(4, "ColorGradeBlending", "Blending", p, outFile)
-        write_knob_a(5, "SplitToningBalance", "Balance", p, outFile)
-        draw_cheat_knob_group(p, 4, 5, "Global")
-        for k in range(6,9):
-            draw_cheat_knob(p, k, "")
+# Seconds without further changes before a burst of saves is built.
+kWatchDebounce = 0.2
+# Seconds between checks of the polling watcher.
+kWatchPollInterval = 0.5
 
-        write_button_upper_ab(6, "EnableColorGrading", "On/Off", p, outFile)
+# Watches files through Linux inotify. The directories are watched rather
+# than the files, so that editors replacing a file on save are noticed.
+#
+class InotifyWatcher:
+    kMask = 0x2 | 0x8 | 0x80 | 0x100 | 0x200   # MODIFY, CLOSE_WRITE, MOVED_TO, CREATE, DELETE
+
+    def __init__ (self, fileNames):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if (self.fd < 0):
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.dirs = {}   # watch descriptor -> (directory, names)
+        byDir = {}
+        for fileName in fileNames:
+            dirName, name = os.path.split(os.path.abspath(fileName))
+            byDir.setdefault(dirName, set()).add(name)
+        for dirName, names in byDir.items():
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirName), self.kMask)
+            if (wd < 0):
+                self.close()
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed: "+dirName)
+            self.dirs[wd] = (dirName, names)
+
+    # The watched files changed since the last call, waiting up to timeout
+    # seconds (None - forever) for the first change.
+    #
+    def changes (self, timeout=None):
+        import select
+        import struct
+        deadline = None if timeout == None else time.monotonic()+timeout
+        changed = set()
+        while (not changed):
+            remaining = None if deadline == None else max(0, deadline-time.monotonic())
+            if (not select.select([self.fd], [], [], remaining)[0]):
+                break
+
+            buf = os.read(self.fd, 65536)
+            offset = 0
+            while (offset < len(buf)):
+                wd, mask, cookie, length = struct.unpack_from("iIII", buf, offset)
+                name = os.fsdecode(buf[offset+16:offset+16+length].rstrip(b"\0"))
+                offset += 16+length
+                dirName, names = self.dirs.get(wd, (None, ()))
+                if (name in names):
+                    changed.add(os.path.join(dirName, name))
+        return changed
+
+    def close (self):
+        if (self.fd >= 0):
+            os.close(self.fd)
+            self.fd = -1
+
+# Watches files by comparing their modification time and size.
+#
+class PollingWatcher:
+    def __init__ (self, fileNames):
+        self.stamps = {os.path.abspath(f): self.stamp(f) for f in fileNames}
+
+    @staticmethod
+    def stamp (fileName):
+        try:
+            st = os.stat(fileName)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def changes (self, timeout=None):
+        deadline = None if timeout == None else time.monotonic()+timeout
+        while (True):
+            changed = set()
+            for fileName, stamp in self.stamps.items():
+                newStamp = self.stamp(fileName)
+                if (newStamp != stamp):
+                    self.stamps[fileName] = newStamp
+                    changed.add(fileName)
+            if (changed or (deadline != None and time.monotonic() >= deadline)):
+                return changed
+            delay = kWatchPollInterval
+            if (deadline != None):
+                delay = min(delay, max(0, deadline-time.monotonic()))
+            time.sleep(delay)
+
+    def close (self):
+        pass
+
+def make_file_watcher (fileNames, polling=False):
+    if (not polling and sys.platform.startswith("linux")):
+        try:
+            return InotifyWatcher(fileNames)
+        except (OSError, AttributeError) as e:
+            print("inotify unavailable ("+str(e)+"), polling for changes.", file=sys.stderr)
+    return PollingWatcher(fileNames)
+
+# Wait for a change, then until no further change follows within debounce
+# seconds. Returns all files changed meanwhile.
+#
+def wait_for_changes (watcher, debounce=kWatchDebounce):
+    changed = watcher.changes()
+    while (True):
+        more = watcher.changes(debounce)
+        if (not more):
+            return changed
+        changed |= more
+
+# Rebuild on every change until interrupted. argv is the command line to
+# restart with.
+#
+def watch (args, argv, targets, numJobs):
+    sources = set(os.path.abspath(f) for f in (__file__, midi2lr_commands.__file__, kFontFile))
+    watched = set(sources)
+    if (args.profiles != None):
+        watched.add(os.path.abspath(args.profiles))
+
+    watcher = make_file_watcher(watched, args.poll)
+    print("Watching for changes, press Ctrl+C to stop.")
+    try:
+        while (True):
+            changed = wait_for_changes(watcher)
+            if (changed & sources):
+                print("Generator changed, restarting.")
+                sys.stdout.flush()
+                watcher.close()
+                argv = [a for a in argv if a not in ("-f", "--force")]
+                os.execv(sys.executable, [sys.executable, os.path.abspath(__file__)]+argv)
+
+            start = time.perf_counter()
+            try:
+                profiles = load_profiles(args.profiles)
+            except Exception as e:
+                # The spec may be half edited; wait for the next save.
+                print("Cannot load "+args.profiles+": "+str(e), file=sys.stderr)
+                continue
+            report_build(args, profiles, build_all(profiles, targets, numJobs))
+            print("Done in %.2f s." % (time.perf_counter()-start))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return 0
 
-        write_nav_grading(4, p, outFile)
-        write_global_nav_keys(7, p, outFile)
 
-        write_footer(outFile)
-        write_cheat_image(p, img, "./Grading-Global.png")
+###############################################################################
+#
+# Build server
+#
+# A long-running process that keeps Qt, the font and the render caches loaded
+# and builds profile sets on request. Clients connect to a Unix socket and
+# send one request per connection as a line of JSON:
+#
+#   {"command": "build", "outputDir": "/path", "spec": "/path/spec.json",
+#    "channel": 11, "xmlOnly": false, "force": false, "atomic": false,
+#    "scales": [1, 2, "svg"], "atlas": null, "encoding": {"format": "png"},
+#    "layerB": null, "devices": []}
+#
+# "devices" holds device descriptors (see Device.to_dict) to build for, each
+# into a directory of its own, instead of the X-Touch Mini.
+#
+# Instead of "spec" a request may carry the profile spec itself as
+# "profiles"; without either the built-in profiles are built. The reply is
+# a line of JSON with the profile count, the rebuilt profiles and the time
+# taken, or an "error". {"command": "shutdown"} stops the server.
+#
+###############################################################################
 
+def handle_build_request (request):
+    devices = [Device.from_dict(d) for d in request.get("devices") or ()]
 
+    if (request.get("profiles") != None):
+        profiles = profiles_from_dict(request["profiles"])
+    elif (request.get("spec") != None):
+        profiles = load_profiles(request["spec"])
+    else:
+        profiles = kProfiles
+
+    cwd = os.getcwd()
+    os.chdir(request["outputDir"])
+    try:
+        targets = build_targets(devices, request.get("channel"), atomic=request.get("atomic", False),
+                                xmlOnly=request.get("xmlOnly", False), scales=request.get("scales", (1,)),
+                                atlas=request.get("atlas"), encoding=ImageEncoding.from_dict(request.get("encoding", {})),
+                                layerB=request.get("layerB"))
+        builds = build_all(profiles, targets, 1, request.get("force", False))
+    finally:
+        os.chdir(cwd)
+
+    return {"profiles": len(profiles)*len(targets),
+            "rebuilt": [options.path(r.name) for options, rebuilt, atlases in builds for r in rebuilt],
+            "atlases": [options.path(f) for options, rebuilt, atlases in builds for f in atlases]}
+
+def read_message (conn):
+    data = b""
+    while (not data.endswith(b"\n")):
+        chunk = conn.recv(65536)
+        if (not chunk):
+            break
+        data += chunk
+    return json.loads(data)
+
+# Serve build requests on the Unix socket socketPath until a shutdown
+# request or an interrupt. Qt is started up front unless xmlOnly is set.
+#
+def serve (socketPath, xmlOnly=False):
+    import socket
+
+    global kFontFile
+    kFontFile = os.path.abspath(kFontFile)
+    if (not xmlOnly):
+        init_qt()
+
+    # Replace a socket left behind by a server that is no longer running.
+    if (os.path.exists(socketPath)):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socketPath)
+        except OSError:
+            os.remove(socketPath)
+        else:
+            probe.close()
+            print("A server is already listening on "+socketPath, file=sys.stderr)
+            return 1
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socketPath)
+    os.chmod(socketPath, 0o600)
+    server.listen()
+    print("Serving build requests on "+socketPath)
+    sys.stdout.flush()
+
+    try:
+        running = True
+        while (running):
+            conn = server.accept()[0]
+            with conn:
+                start = time.perf_counter()
+                try:
+                    request = read_message(conn)
+                    if (request.get("command") == "shutdown"):
+                        running = False
+                        response = {}
+                    else:
+                        response = handle_build_request(request)
+                except Exception as e:
+                    # Report the failure to the client and keep serving.
+                    response = {"error": type(e).__name__+": "+str(e)}
+                response["seconds"] = time.perf_counter()-start
+                try:
+                    conn.sendall(json.dumps(response).encode()+b"\n")
+                except OSError:
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(socketPath)
+    return 0
+
+# Send a request to the server on socketPath and return its reply.
+#
+def send_request (socketPath, request):
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(socketPath)
+        conn.sendall(json.dumps(request).encode()+b"\n")
+        conn.shutdown(socket.SHUT_WR)
+        return read_message(conn)
+
+# Build through the server instead of in this process.
+#
+def build_remote (args):
+    if (args.shutdown):
+        request = {"command": "shutdown"}
+    else:
+        request = {
+            "command": "build",
+            "outputDir": os.getcwd(),
+            "spec": os.path.abspath(args.profiles) if args.profiles != None else None,
+            "channel": args.channel,
+            "xmlOnly": args.xml_only,
+            "force": args.force,
+            "atomic": args.atomic,
+            "scales": args.scales,
+            "atlas": args.atlas,
+            "encoding": image_encoding(args).to_dict(),
+            "layerB": args.layer_b,
+            "devices": [load_device(f).to_dict() for f in args.device],
+        }
+
+    response = send_request(args.connect, request)
+    if (response.get("error") != None):
+        print("Build server: "+response["error"], file=sys.stderr)
+        return 1
+    if (args.shutdown):
+        return 0
+
+    rebuilt = response["rebuilt"]
+    if (rebuilt):
+        print("Rebuilt "+str(len(rebuilt))+" of "+str(response["profiles"])+" profiles: "+", ".join(rebuilt))
+    else:
+        print("All "+str(response["profiles"])+" profiles are up to date.")
+    for fileName in response.get("atlases", ()):
+        print("Wrote atlas "+fileName)
+    if (args.verbose):
+        print("Build server took %.1f ms" % (response["seconds"]*1000))
+    return 0
 
 
 ###############################################################################
@@ -973,30 +2975,282 @@ def write_profile_grading_global ():
 #
 ###############################################################################
 
-app = QApplication(["-platform offscreen"])
-QFontDatabase.addApplicationFont("./SourceSansPro-SemiBold.ttf")
+# Report the references of the profiles and the config that do not resolve.
+# Returns the exit status: 1 if there are any.
+#
+def check_config (profiles, fileName, queries=()):
+    import midi2lr_config
+    config = midi2lr_config.load_config(fileName)
+    index  = midi2lr_config.ConfigIndex(config, {p.name: profile_commands(p) for p in profiles})
 
-write_profile_library()
-write_profile_crop()
-write_profile_transform()
-write_profile_lens()
+    for reference in queries:
+        print(reference+": "+(", ".join(index.users_of(reference)) or "unused"))
 
-write_profile_tone()
-write_profile_presence()
-write_profile_gradient()
-write_profile_brush()
-write_profile_tone_curve()
+    emptySlots = index.empty_slots()
+    if (emptySlots):
+        print("Empty profile slots: "+", ".join(emptySlots))
 
-write_profile_colors_hue()
-write_profile_colors_saturation()
-write_profile_colors_luminance()
+    problems = index.problems()
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
 
-write_profile_colors_gray()
+# Validate the profiles and report the diagnostics. Returns the exit status: 1
+# if there are any errors.
+#
+def validate (profiles, addresses, jsonFile=None):
+    diagnostics = validate_profiles(profiles, addresses)
+
+    if (jsonFile == "-"):
+        json.dump([d.to_dict() for d in diagnostics], sys.stdout, indent=1)
+        print()
+    else:
+        for diagnostic in diagnostics:
+            print(diagnostic)
+        if (jsonFile != None):
+            with open(jsonFile, "w") as f:
+                json.dump([d.to_dict() for d in diagnostics], f, indent=1)
+                f.write("\n")
+
+    errors = sum(1 for d in diagnostics if d.severity == kError)
+    if (jsonFile != "-"):
+        print("Validated "+str(len(profiles))+" profiles: "+str(errors)+" errors, "+str(len(diagnostics)-errors)+" warnings")
+    return 1 if errors else 0
+
+# Parse a --scales list such as "1,2,svg".
+#
+def parse_scales (text):
+    scales = []
+    for item in text.split(","):
+        item = item.strip().lower().rstrip("x")
+        if (item != "svg"):
+            try:
+                item = float(item)
+            except ValueError:
+                raise argparse.ArgumentTypeError("invalid scale: "+item)
+            if (item <= 0):
+                raise argparse.ArgumentTypeError("scales must be positive")
+            if (item == int(item)):
+                item = int(item)
+        if (item not in scales):
+            scales.append(item)
+    return tuple(scales)
+
+def parse_args (argv):
+    parser = argparse.ArgumentParser(description="Generate MIDI2LR profiles and cheat images for the Behringer X-Touch Mini.")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of worker processes (default: number of CPUs, or 1 with --xml-only; 1 builds serially)")
+    parser.add_argument("-x", "--xml-only", action="store_true",
+                        help="write the XML profiles only; no cheat images, PyQt5 is not loaded")
+    parser.add_argument("-s", "--scales", type=parse_scales, default=(1,), metavar="LIST",
+                        help="cheat image scales to write, e.g. 1,2,3,svg (default: 1); scale N is written as NAME@Nx.png")
+    parser.add_argument("--image-format", choices=kImageFormats, default="png",
+                        help="format of the cheat images (default: png); webp is lossless unless --quality is given")
+    parser.add_argument("--palette", action="store_true",
+                        help="write 8-bit palette PNGs where the palette is exact (at most 256 colors), truecolor PNGs otherwise")
+    parser.add_argument("--compression", type=int, choices=range(0, 10), metavar="0-9",
+                        help="PNG compression level (default: Qt's default)")
+    parser.add_argument("--quality", type=int, choices=range(0, 100), metavar="0-99",
+                        help="write lossy WebP images of this quality")
+    parser.add_argument("--optimize", action="store_true",
+                        help="write each PNG in the smallest lossless encoding found, at the cost of encoding time")
+    parser.add_argument("--layer-b", choices=("sheet", "combined"),
+                        help="also draw the layer B assignments: in a NAME-B sheet of their own, or below layer A in the same image")
+    parser.add_argument("--atlas", choices=("all", "group"),
+                        help="write the cheat images as one atlas image of all profiles or one per navigation group, indexed in "+kAtlasIndexFile)
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="rebuild all profiles, ignoring the build cache")
+    parser.add_argument("-c", "--channel", type=int, choices=range(1, 17), metavar="1-16",
+                        help="global MIDI channel of the controller (default: "+str(kDefaultChannel)+" or the device's)")
+    parser.add_argument("-d", "--device", metavar="FILE", action="append", default=[],
+                        help="build for the controller described in the JSON device descriptor FILE, into a directory named after the device; repeat to build for several devices")
+    parser.add_argument("--atomic", action="store_true",
+                        help="write each XML profile to a temporary file and rename it into place")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="report render cache statistics and the size and encoding time of each cheat image")
+    parser.add_argument("-t", "--timings", action="store_true",
+                        help="print the time spent in each build phase per profile")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write the build phases as a Chrome trace (chrome://tracing, Perfetto) to FILE")
+    parser.add_argument("--profile-stats", metavar="FILE",
+                        help="run the build serially under cProfile and dump the pstats data to FILE")
+    parser.add_argument("-p", "--profiles", metavar="SPEC",
+                        help="build the profiles from a .json, .toml or .yaml profile spec instead of the built-in ones")
+    parser.add_argument("--config", metavar="FILE",
+                        help="update the Profiles and ActionSeries of a MIDI2LR config file (MIDI2LR_XTouch_Config.txt) to match the profiles")
+    parser.add_argument("--check-config", metavar="FILE",
+                        help="check that the ActionSeries, Key and profile slot references of the profiles and of a MIDI2LR config file resolve, and exit")
+    parser.add_argument("--query", metavar="REF", action="append", default=[],
+                        help="with --check-config, list the profiles using REF (e.g. ActionSeries9, Key1, profile3)")
+    parser.add_argument("--validate", action="store_true",
+                        help="check the generated XML of every profile for collisions, out of range numbers, unbound LEDs and bad commands, and exit")
+    parser.add_argument("--diagnostics", metavar="FILE",
+                        help="with --validate, also write the diagnostics as JSON to FILE (- for standard output)")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="after building, rebuild the affected profiles whenever the profile spec, generator or font changes")
+    parser.add_argument("--poll", action="store_true",
+                        help="with --watch, poll for changes instead of using inotify")
+    parser.add_argument("--serve", metavar="SOCKET",
+                        help="run a build server on the Unix socket SOCKET that keeps Qt and the font loaded between builds")
+    parser.add_argument("--connect", metavar="SOCKET",
+                        help="build through the build server on SOCKET, writing to the current directory")
+    parser.add_argument("--shutdown", action="store_true",
+                        help="with --connect, stop the build server")
+    parser.add_argument("-i", "--import-xml", metavar="PATH",
+                        help="read the profiles from a MIDI2LR XML profile or a directory of them instead of the built-in ones")
+    parser.add_argument("--render", metavar="DIR",
+                        help="render the cheat images of the MIDI2LR XML profiles in DIR as they are into the current directory, and exit")
+    parser.add_argument("--export-profiles", metavar="FILE",
+                        help="write the profiles as a JSON profile spec and exit")
+    args = parser.parse_args(argv)
+
+    # These work on one address table.
+    if (len(args.device) > 1):
+        for option, value in (("--validate", args.validate or args.diagnostics != None),
+                              ("--import-xml", args.import_xml), ("--render", args.render)):
+            if (value):
+                parser.error(option+" takes at most one --device")
+    return args
+
+# The device of the command line for the options that work on one device:
+# the --device, or the X-Touch Mini.
+#
+def single_device (args):
+    if (args.device):
+        return load_device(args.device[0])
+    return kDeviceXTouchMini
 
-write_profile_effects()
-write_profile_detail()
+def image_encoding (args):
+    return ImageEncoding(args.image_format, args.palette, args.compression, args.quality, args.optimize)
 
-write_profile_grading_mid()
-write_profile_grading_high()
-write_profile_grading_shadow()
-write_profile_grading_global()
+# Print the size and encoding time of the cheat images of each profile.
+#
+def print_image_stats (rebuilt):
+    totalSize = 0
+    totalTime = 0
+    for result in rebuilt:
+        for fileName, size, seconds in result.images:
+            print("  %-32s %9.1f KiB %8.2f ms" % (fileName, size/1024, seconds*1000))
+            totalSize += size
+            totalTime += seconds
+    print("  %-32s %9.1f KiB %8.2f ms" % ("total", totalSize/1024, totalTime*1000))
+
+# Print the outcome of a build and do the work that follows it. builds holds
+# (options, rebuilt, atlases) per target, see build_all.
+#
+def report_build (args, profiles, builds):
+    for options, rebuilt, atlases in builds:
+        prefix = options.outputDir+": " if options.outputDir != "" else ""
+        if (rebuilt):
+            print(prefix+"Rebuilt "+str(len(rebuilt))+" of "+str(len(profiles))+" profiles: "+", ".join(r.name for r in rebuilt))
+        else:
+            print(prefix+"All "+str(len(profiles))+" profiles are up to date.")
+        for fileName in atlases:
+            print("Wrote atlas "+options.path(fileName))
+    rebuilt = [r for options, results, atlases in builds for r in results]
+
+    if (args.config != None):
+        import midi2lr_config
+        config = midi2lr_config.load_config(args.config)
+        midi2lr_config.update_config(config, profiles)
+        midi2lr_config.save_config(config, args.config)
+
+    if (args.verbose and rebuilt):
+        hits   = sum(r.cacheHits for r in rebuilt)
+        misses = sum(r.cacheMisses for r in rebuilt)
+        print("Render cache: "+str(hits)+" hits, "+str(misses)+" misses")
+        if (any(r.images for r in rebuilt)):
+            print("Cheat images:")
+            print_image_stats(rebuilt)
+
+    events = [e for r in rebuilt for e in r.events]
+    if (args.timings and rebuilt):
+        print_timings(events)
+    if (args.trace != None):
+        write_chrome_trace(events, args.trace)
+
+# Render the cheat images of the profiles in args.render. Returns the exit
+# status: 1 if a file could not be read.
+#
+def render (args, numJobs):
+    device = single_device(args)
+    options = BuildOptions(device.address_map(args.channel), timings=args.timings or args.trace != None,
+                           scales=args.scales, encoding=image_encoding(args), device=device)
+    rendered, diagnostics = render_profiles(args.render, options, numJobs)
+    for diagnostic in diagnostics:
+        print(diagnostic, file=sys.stderr)
+    print("Rendered "+str(len(rendered))+" profiles from "+args.render)
+
+    if (args.verbose and rendered):
+        print_image_stats(rendered)
+    events = [e for r in rendered for e in r.events]
+    if (args.timings and rendered):
+        print_timings(events)
+    if (args.trace != None):
+        write_chrome_trace(events, args.trace)
+    return 1 if any(d.severity == kError and d.code == "malformed" for d in diagnostics) else 0
+
+def main (argv=None):
+    argv = sys.argv[1:] if argv == None else argv
+    args = parse_args(argv)
+
+    # The client leaves loading the profiles to the server.
+    if (args.connect != None):
+        return build_remote(args)
+    if (args.serve != None):
+        return serve(args.serve, args.xml_only)
+
+    profiles = kProfiles
+    if (args.profiles != None):
+        profiles = load_profiles(args.profiles)
+    elif (args.import_xml != None):
+        profiles, diagnostics = import_profiles(args.import_xml, single_device(args).address_map(args.channel))
+        for diagnostic in diagnostics:
+            print(diagnostic, file=sys.stderr)
+        print("Imported "+str(len(profiles))+" profiles from "+args.import_xml)
+
+    if (args.export_profiles != None):
+        save_profiles(profiles, args.export_profiles)
+        return 0
+
+    if (args.check_config != None):
+        return check_config(profiles, args.check_config, args.query)
+
+    if (args.validate or args.diagnostics != None):
+        return validate(profiles, single_device(args).address_map(args.channel), args.diagnostics)
+
+    # A process pool costs more to start than writing the XML takes. Watch
+    # mode builds in this process, where Qt stays loaded between builds.
+    numJobs = args.jobs
+    if (numJobs == None):
+        numJobs = 1 if (args.xml_only or args.watch) else (os.cpu_count() or 1)
+
+    # cProfile only sees this process.
+    profiler = None
+    if (args.profile_stats != None):
+        import cProfile
+        numJobs  = 1
+        profiler = cProfile.Profile()
+
+    if (args.render != None):
+        return render(args, numJobs)
+
+    targets = build_targets([load_device(f) for f in args.device], args.channel, atomic=args.atomic,
+                            xmlOnly=args.xml_only, timings=args.timings or args.trace != None, scales=args.scales,
+                            atlas=args.atlas, encoding=image_encoding(args), layerB=args.layer_b)
+
+    if (profiler != None):
+        profiler.enable()
+    builds = build_all(profiles, targets, numJobs, args.force)
+    if (profiler != None):
+        profiler.disable()
+        profiler.dump_stats(args.profile_stats)
+
+    report_build(args, profiles, builds)
+
+    if (args.watch):
+        return watch(args, argv, targets, numJobs)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
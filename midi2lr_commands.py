@@ -0,0 +1,333 @@
+###############################################################################
+#
+# Catalogue of MIDI2LR commands.
+#
+# Every command string a profile may assign, with its type:
+#   absolute  A Lightroom parameter set from the knob position (sliders)
+#   repeat    A command sent repeatedly while the knob turns (brush size)
+#   button    A single action
+# and whether MIDI2LR has a "Reset<command>" for it. Reset commands
+# themselves are not listed; command_info() derives them.
+#
+# kCommandLabels holds the short labels printed on the cheat images.
+#
+# The catalogue is plain Python data, so it is loaded from the compiled .pyc
+# in __pycache__ like any module and lookups are dictionary lookups.
+# kCatalogueVersion names the MIDI2LR release it lists. Bump
+# kCatalogueRevision when changing it; the version and revision are part of
+# the build cache key (see generator_key in build_midi2lr_files.py), so a bump
+# rebuilds all profiles.
+#
+###############################################################################
+
+import bisect
+import difflib
+import re
+import sys
+
+kCatalogueVersion  = "MIDI2LR 5"
+kCatalogueRevision = 3
+
+kTypeAbsolute = "absolute"
+kTypeRepeat   = "repeat"
+kTypeButton   = "button"
+
+kColors = ("Red", "Orange", "Yellow", "Green", "Aqua", "Blue", "Purple", "Magenta")
+
+# Develop parameters. All of them can be reset.
+kDevelopParameters = (
+    # Basic
+    "Temperature", "Tint", "Exposure", "Contrast", "Highlights", "Shadows", "Whites", "Blacks",
+    "Texture", "Clarity", "Dehaze", "Vibrance", "Saturation",
+    "Brightness", "Clarity2012", "Contrast2012", "Exposure2012", "Highlights2012", "Shadows2012",
+    "Whites2012", "Blacks2012", "HighlightRecovery", "FillLight",
+
+    # Tone curve
+    "ParametricDarks", "ParametricLights", "ParametricShadows", "ParametricHighlights",
+    "ParametricShadowSplit", "ParametricMidtoneSplit", "ParametricHighlightSplit",
+
+    # Color mixer
+    ) + tuple("HueAdjustment"+c for c in kColors) \
+      + tuple("SaturationAdjustment"+c for c in kColors) \
+      + tuple("LuminanceAdjustment"+c for c in kColors) \
+      + tuple("GrayMixer"+c for c in kColors) + (
+
+    # Split toning and color grading
+    "SplitToningShadowHue", "SplitToningShadowSaturation",
+    "SplitToningHighlightHue", "SplitToningHighlightSaturation", "SplitToningBalance",
+    "ColorGradeBlending",
+    "ColorGradeGlobalHue", "ColorGradeGlobalSat", "ColorGradeGlobalLum",
+    "ColorGradeMidtoneHue", "ColorGradeMidtoneSat", "ColorGradeMidtoneLum",
+    "ColorGradeShadowLum", "ColorGradeHighlightLum",
+
+    # Detail
+    "Sharpness", "SharpenRadius", "SharpenDetail", "SharpenEdgeMasking",
+    "LuminanceSmoothing", "LuminanceNoiseReductionDetail", "LuminanceNoiseReductionContrast",
+    "ColorNoiseReduction", "ColorNoiseReductionDetail", "ColorNoiseReductionSmoothness",
+
+    # Lens corrections
+    "LensProfileDistortionScale", "LensProfileVignettingScale", "LensManualDistortionAmount",
+    "DefringePurpleAmount", "DefringePurpleHueLo", "DefringePurpleHueHi",
+    "DefringeGreenAmount", "DefringeGreenHueLo", "DefringeGreenHueHi",
+    "VignetteAmount", "VignetteMidpoint",
+
+    # Transform
+    "PerspectiveVertical", "PerspectiveHorizontal", "PerspectiveRotate", "PerspectiveScale",
+    "PerspectiveAspect", "PerspectiveX", "PerspectiveY",
+
+    # Effects
+    "PostCropVignetteAmount", "PostCropVignetteMidpoint", "PostCropVignetteRoundness",
+    "PostCropVignetteFeather", "PostCropVignetteHighlightContrast",
+    "GrainAmount", "GrainSize", "GrainFrequency",
+
+    # Calibration
+    "ShadowTint", "RedHue", "RedSaturation", "GreenHue", "GreenSaturation", "BlueHue", "BlueSaturation",
+
+    # Crop
+    "CropAngle", "CropTop", "CropLeft", "CropRight", "CropBottom", "straightenAngle",
+)
+
+# Local adjustments (brush, graduated and radial filter). These can be reset
+# too. There is no local vibrance.
+kLocalParameters = (
+    "local_Temperature", "local_Tint", "local_Exposure", "local_Contrast", "local_Highlights",
+    "local_Shadows", "local_Whites2012", "local_Blacks2012", "local_Texture", "local_Clarity",
+    "local_Dehaze", "local_Hue", "local_Saturation", "local_Sharpness", "local_LuminanceNoise",
+    "local_Moire", "local_Defringe",
+)
+
+kRepeatCommands = (
+    "ChangeBrushSize", "ChangeFeatherSize", "ChangeCurrentSlider", "ChangeLastDevelopParameter",
+)
+
+kButtonNames = (
+    # Library
+    "Pick", "Reject", "RemoveFlag", "SetRating0", "SetRating1", "SetRating2", "SetRating3",
+    "SetRating4", "SetRating5", "IncreaseRating", "DecreaseRating",
+    "ToggleBlue", "ToggleGreen", "TogglePurple", "ToggleRed", "ToggleYellow",
+    "AddOrRemoveFromTargetColl", "Next", "Prev", "VirtualCopy",
+
+    # General
+    "Undo", "Redo", "CopySettings", "PasteSettings", "PasteSelectedSettings", "ResetAll", "ResetLast",
+    "ShoVwgrid", "ShoVwloupe", "ShoVwcompare", "ShoVwsurvey", "ShoVwpeople",
+    "ShoFullHidePanels", "ShoFullPreview",
+    "SwToMlibrary", "SwToMdevelop", "SwToMmap", "SwToMbook", "SwToMslideshow", "SwToMprint", "SwToMweb",
+    "ToggleZoomOffOn", "ZoomInLargeStep", "ZoomInSmallStep", "ZoomOutLargeStep", "ZoomOutSmallStep",
+    "PrevPro", "NextPro",
+
+    # Develop tools
+    "Loupe", "CropOverlay", "SpotRemoval", "RedEye", "GraduatedFilter", "RadialFilter", "AdjustmentBrush",
+    "CropConstrainToWarp", "ResetCrop",
+
+    # Develop panels
+    "RevealPanelAdjust", "RevealPanelTone", "RevealPanelMixer", "RevealPanelColorGrading",
+    "RevealPanelSplitToning", "RevealPanelDetail", "RevealPanelLens", "RevealPanelTransform",
+    "RevealPanelEffects", "RevealPanelCalibrate",
+    "EnableBasic", "EnableCalibration", "EnableCircularGradientBasedCorrections",
+    "EnableColorAdjustments", "EnableColorGrading", "EnableDetail", "EnableEffects",
+    "EnableGradientBasedCorrections", "EnableGrayscaleMix", "EnableLensCorrections",
+    "EnablePaintBasedCorrections", "EnableRedEye", "EnableRetouch", "EnableSplitToning",
+    "EnableToneCurve", "EnableTransform",
+    "SetTreatmentBW", "SetTreatmentColor", "ConvertToGrayscale",
+    "ColorGrade3Way", "ColorGradeGlobal", "ColorGradeShadow", "ColorGradeMidtone", "ColorGradeHighlight",
+    "AutoTone", "AutoLateralCA", "LensProfileEnable",
+    "UprightOff", "UprightAuto", "UprightLevel", "UprightVertical", "UprightFull",
+    ) + tuple("Key"+str(n) for n in range(1, 41)) \
+      + tuple("ActionSeries"+str(n) for n in range(1, 17)) \
+      + tuple("profile"+str(n) for n in range(1, 27))
+
+def build_catalogue ():
+    catalogue = {}
+    for name in kDevelopParameters+kLocalParameters:
+        catalogue[name] = (kTypeAbsolute, True)
+    for name in kRepeatCommands:
+        catalogue[name] = (kTypeRepeat, False)
+    for name in kButtonNames:
+        catalogue[name] = (kTypeButton, False)
+    return catalogue
+
+kCommands     = build_catalogue()
+kCommandNames = tuple(sorted(kCommands))
+kLowerNames   = {name.lower(): name for name in kCommandNames}
+
+# Every valid command string including the resets, and those suitable for a
+# knob (absolute and repeat) or a button (button and reset), for set checks.
+kResetCommands  = frozenset("Reset"+name for name, info in kCommands.items() if info[1])
+kKnownCommands  = frozenset(kCommands) | kResetCommands
+kKnobCommands   = frozenset(name for name, info in kCommands.items() if info[0] != kTypeButton)
+kButtonCommands = kKnownCommands - kKnobCommands
+
+# Cheat image labels of commands whose name does not make a short label.
+kShortLabels = {
+    "Temperature": "Temp", "local_Temperature": "Temp",
+    "HighlightRecovery": "Recovery",
+
+    "ParametricHighlightSplit": "Split High", "ParametricMidtoneSplit": "Split Mid",
+    "ParametricShadowSplit": "Split Low",
+
+    "SplitToningShadowHue": "Hue", "SplitToningShadowSaturation": "Saturation",
+    "SplitToningHighlightHue": "Hue", "SplitToningHighlightSaturation": "Saturation",
+    "SplitToningBalance": "Balance", "ColorGradeBlending": "Blending",
+    "ColorGradeGlobalHue": "Hue", "ColorGradeGlobalSat": "Saturation", "ColorGradeGlobalLum": "Luminance",
+    "ColorGradeMidtoneHue": "Hue", "ColorGradeMidtoneSat": "Saturation", "ColorGradeMidtoneLum": "Luminance",
+    "ColorGradeShadowLum": "Luminance", "ColorGradeHighlightLum": "Luminance",
+
+    "SharpenRadius": "Radius", "SharpenDetail": "Detail", "SharpenEdgeMasking": "Edge",
+    "LuminanceSmoothing": "Smoothing", "LuminanceNoiseReductionDetail": "Noise Det",
+    "LuminanceNoiseReductionContrast": "Noise Cont", "ColorNoiseReduction": "Color Noise",
+    "ColorNoiseReductionDetail": "Color Det", "ColorNoiseReductionSmoothness": "Color Smooth",
+
+    "LensProfileDistortionScale": "Distortion", "LensProfileVignettingScale": "Vignetting",
+    "LensManualDistortionAmount": "Distortion",
+    "DefringePurpleAmount": "Amount", "DefringePurpleHueLo": "Hue Lo", "DefringePurpleHueHi": "Hue Hi",
+    "DefringeGreenAmount": "Amount", "DefringeGreenHueLo": "Hue Lo", "DefringeGreenHueHi": "Hue Hi",
+    "VignetteAmount": "Vignette", "VignetteMidpoint": "Midpoint",
+
+    "PerspectiveVertical": "Vertical", "PerspectiveHorizontal": "Horizontal", "PerspectiveRotate": "Rotate",
+    "PerspectiveScale": "Scale", "PerspectiveAspect": "Aspect", "PerspectiveX": "Offset X",
+    "PerspectiveY": "Offset Y",
+
+    "PostCropVignetteAmount": "Amount", "PostCropVignetteMidpoint": "Midpoint",
+    "PostCropVignetteRoundness": "Roundness", "PostCropVignetteFeather": "Feather",
+    "PostCropVignetteHighlightContrast": "Highlights",
+    "GrainAmount": "Amount", "GrainSize": "Size", "GrainFrequency": "Frequency",
+
+    "CropAngle": "Angle", "CropTop": "Top", "CropLeft": "Left", "CropRight": "Right",
+    "CropBottom": "Bottom", "straightenAngle": "Angle",
+
+    "local_LuminanceNoise": "Noise", "local_Moire": "Moire", "local_Defringe": "Defringe",
+
+    "ChangeBrushSize": "Brush Size", "ChangeFeatherSize": "Feather", "ChangeCurrentSlider": "Slider",
+    "ChangeLastDevelopParameter": "Last Param",
+
+    "Pick": "Flag", "RemoveFlag": "Clear", "AddOrRemoveFromTargetColl": "Target",
+    "ShoVwgrid": "Grid", "ShoVwloupe": "Loupe", "ShoVwcompare": "Compare", "ShoVwsurvey": "Survey",
+    "ShoVwpeople": "People", "ShoFullHidePanels": "Panels", "ShoFullPreview": "Preview",
+    "IncreaseRating": "Rating +", "DecreaseRating": "Rating -",
+    "ZoomInLargeStep": "Zoom In", "ZoomInSmallStep": "Zoom In", "ZoomOutLargeStep": "Zoom Out",
+    "ZoomOutSmallStep": "Zoom Out", "ToggleZoomOffOn": "Zoom", "CropConstrainToWarp": "Crop",
+    "SetTreatmentBW": "B/W", "SetTreatmentColor": "Color",
+
+    "GraduatedFilter": "Gradient", "AdjustmentBrush": "Brush", "RadialFilter": "Radial",
+    "SpotRemoval": "Spot", "CropOverlay": "Crop", "VirtualCopy": "Copy",
+    "CopySettings": "Copy", "PasteSettings": "Paste",
+}
+# Prefixes of commands that are labeled with their color alone
+# ("HueAdjustmentRed" - "Red").
+kColorPrefixes = ("HueAdjustment", "SaturationAdjustment", "LuminanceAdjustment", "GrayMixer")
+
+# The cheat image labels of commands: kShortLabels and the labels of command
+# series such as the colors, ratings and action series. command_label()
+# derives the others from the command name.
+#
+def build_labels ():
+    labels = dict(kShortLabels)
+    for prefix in kColorPrefixes:
+        for color in kColors:
+            labels[prefix+color] = color
+    for n in range(6):
+        labels["SetRating"+str(n)] = "Rating "+str(n)
+    for name in kButtonNames:
+        if (name[:12] == "ActionSeries"):
+            labels[name] = "Series "+name[12:]
+        elif (name[:6] == "Enable"):
+            labels[name] = "On/Off"
+    return labels
+
+kCommandLabels = build_labels()
+
+# Prefixes left out of derived labels.
+kLabelPrefixes = ("local_", "Parametric", "RevealPanel")
+
+
+###############################################################################
+#
+# Lookup.
+#
+###############################################################################
+
+# The (type, resettable) of a command, or None if it is unknown. The reset
+# command of a resettable parameter is a button.
+#
+def command_info (command):
+    info = kCommands.get(command)
+    if (info == None and command[:5] == "Reset"):
+        base = kCommands.get(command[5:])
+        if (base != None and base[1]):
+            return (kTypeButton, False)
+    return info
+
+def is_known (command):
+    return command_info(command) != None
+
+# Unknown commands are assumed to be resettable, so that a parameter added to
+# MIDI2LR after this catalogue keeps its knob push reset.
+#
+def is_resettable (command):
+    info = kCommands.get(command)
+    return info == None or info[1]
+
+kWordRe = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+# The cheat image label of a command: the entry in kCommandLabels or the
+# words of the command name without a prefix from kLabelPrefixes and process
+# version numbers ("local_Whites2012" - "Whites").
+#
+def command_label (command):
+    label = kCommandLabels.get(command)
+    if (label != None):
+        return label
+    if (command[:5] == "Reset" and command_info(command) != None):
+        return "Reset "+command_label(command[5:])
+    for prefix in kLabelPrefixes:
+        if (command.startswith(prefix) and len(command) > len(prefix)):
+            return command_label(command[len(prefix):])
+
+    words = [w for w in kWordRe.findall(command) if w != "2012"]
+    return " ".join(w[:1].upper()+w[1:] for w in words) or command
+
+# Known commands that look like a mistyped command, best match first.
+#
+def suggest (command, count=3):
+    exact = kLowerNames.get(command.lower())
+    if (exact != None and exact != command):
+        return [exact]
+    if (command[:5] == "Reset"):
+        return ["Reset"+s for s in suggest(command[5:], count) if kCommands[s][1]]
+    return difflib.get_close_matches(command, kCommandNames, count, 0.75)
+
+# Known commands starting with prefix, in sorted order.
+#
+def complete (prefix):
+    start = bisect.bisect_left(kCommandNames, prefix)
+    end   = bisect.bisect_left(kCommandNames, prefix+"\U0010ffff", start)
+    return list(kCommandNames[start:end])
+
+
+###############################################################################
+#
+# Main
+#
+###############################################################################
+
+# List the commands starting with a prefix, or suggest corrections for an
+# unknown command.
+#
+def main (argv=None):
+    argv = sys.argv[1:] if argv == None else argv
+    prefix = argv[0] if argv else ""
+
+    print(kCatalogueVersion+" command catalogue, revision "+str(kCatalogueRevision))
+    names = complete(prefix)
+    if (not names and prefix != ""):
+        names = suggest(prefix)
+        if (names):
+            print("Unknown command "+prefix+", did you mean:", file=sys.stderr)
+
+    for name in names:
+        kind, resettable = kCommands[name]
+        print("%-40s %-9s %s" % (name, kind, "resettable" if resettable else ""))
+    return 0 if names else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
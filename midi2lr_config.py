@@ -0,0 +1,549 @@
+###############################################################################
+#
+# Reader and writer for MIDI2LR_XTouch_Config.txt.
+#
+# MIDI2LR stores its settings as a serialised Lua table:
+#
+#   do local _={{PasteList={},...,Profiles={...},ActionSeries={...}}};return _;end
+#
+# The file is read into LuaTable objects that keep every entry in its original
+# order, so a config that is read and written back unchanged is byte-identical
+# and keys this module does not know about survive a round-trip.
+#
+# Tokenizing and parsing are a single left-to-right pass, linear in the size
+# of the file.
+#
+###############################################################################
+
+import os
+import re
+import sys
+
+
+###############################################################################
+#
+# Lua tables.
+#
+###############################################################################
+
+# An ordered Lua table. items is a list of [key, value] pairs; key is None for
+# positional (array) entries, a str for name and string keys and an int or
+# float for bracketed number keys.
+#
+class LuaTable:
+    __slots__ = ("items", "index")
+
+    def __init__ (self, items=()):
+        self.items = []
+        self.index = {}
+        for key, value in items:
+            self.append(key, value)
+
+    def append (self, key, value):
+        if (key != None):
+            self.index[key] = len(self.items)
+        self.items.append([key, value])
+
+    def get (self, key, default=None):
+        pos = self.index.get(key)
+        if (pos == None):
+            return default
+        return self.items[pos][1]
+
+    # Replace the value of key in place, or add it at the end.
+    #
+    def set (self, key, value):
+        pos = self.index.get(key)
+        if (pos == None):
+            self.append(key, value)
+        else:
+            self.items[pos][1] = value
+
+    def __contains__ (self, key):
+        return key in self.index
+
+    # The positional entries, in order.
+    #
+    def array (self):
+        return [value for key, value in self.items if key == None]
+
+    # Replace the n-th positional entry (1-based), appending empty strings
+    # when the array is shorter.
+    #
+    def set_array (self, n, value, fill=""):
+        count = 0
+        for item in self.items:
+            if (item[0] == None):
+                count += 1
+                if (count == n):
+                    item[1] = value
+                    return
+        while (count < n-1):
+            self.append(None, fill)
+            count += 1
+        self.append(None, value)
+
+    def keys (self):
+        return [key for key, value in self.items if key != None]
+
+
+###############################################################################
+#
+# Tokenizer.
+#
+###############################################################################
+
+class LuaSyntaxError (ValueError):
+    pass
+
+kTokenRe = re.compile(r"""
+    (?P<space>  \s+ | --[^\n]* )
+  | (?P<string> "(?:[^"\\\n]|\\[\s\S])*" | '(?:[^'\\\n]|\\[\s\S])*' )
+  | (?P<number> 0[xX][0-9a-fA-F]+ | (?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)? )
+  | (?P<name>   [A-Za-z_][A-Za-z0-9_]* )
+  | (?P<op>     [{}\[\]=,;\-] )
+""", re.VERBOSE)
+
+kEscapes = {
+    "a": "\a", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v",
+    "\\": "\\", "\"": "\"", "'": "'", "\n": "\n",
+}
+
+kEscapeRe = re.compile(r"\\(\d{1,3}|x[0-9a-fA-F]{2}|z\s*|u\{[0-9a-fA-F]+\}|[\s\S])")
+
+kConstants = {"true": True, "false": False, "nil": None}
+
+def unescape_match (m):
+    esc = m.group(1)
+    if (esc[0].isdigit()):
+        return chr(int(esc))
+    if (esc[0] == "x"):
+        return chr(int(esc[1:], 16))
+    if (esc[0] == "z"):
+        return ""
+    if (esc[0] == "u"):
+        return chr(int(esc[2:-1], 16))
+    if (esc in kEscapes):
+        return kEscapes[esc]
+    raise LuaSyntaxError("Invalid escape sequence \\"+esc)
+
+def parse_number (text):
+    if (text[:2].lower() == "0x"):
+        return int(text, 16)
+    if ("." in text or "e" in text or "E" in text):
+        return float(text)
+    return int(text)
+
+# Yield (kind, value, offset) tokens; kind is "string", "number", "name" or
+# "op", followed by a final ("eof", None, offset) token. Whitespace and
+# comments are skipped.
+#
+def tokenize (text):
+    pos = 0
+    for m in kTokenRe.finditer(text):
+        if (m.start() != pos):
+            break
+        pos = m.end()
+        kind = m.lastgroup
+        if (kind == "string"):
+            value = m.group()[1:-1]
+            if ("\\" in value):
+                value = kEscapeRe.sub(unescape_match, value)
+            yield ("string", value, m.start())
+        elif (kind == "number"):
+            yield ("number", parse_number(m.group()), m.start())
+        elif (kind != "space"):
+            yield (kind, m.group(), m.start())
+
+    if (pos != len(text)):
+        raise LuaSyntaxError("Unexpected character %r at offset %d" % (text[pos], pos))
+    yield ("eof", None, pos)
+
+
+###############################################################################
+#
+# Parser.
+#
+###############################################################################
+
+# A recursive descent parser for Lua table constructors, reading one token
+# ahead of the token stream.
+#
+class LuaParser:
+    def __init__ (self, text):
+        self.tokens = tokenize(text)
+        self.advance()
+
+    def advance (self):
+        self.kind, self.token, self.pos = next(self.tokens)
+
+    def fail (self, expected):
+        raise LuaSyntaxError("Expected %s at offset %d, got %r" % (expected, self.pos, self.token))
+
+    def expect (self, kind, token=None):
+        if (self.kind != kind or (token != None and self.token != token)):
+            self.fail(token or kind)
+        self.advance()
+
+    def accept (self, token):
+        if (self.kind == "op" and self.token == token):
+            self.advance()
+            return True
+        return False
+
+    def accept_name (self, name):
+        if (self.kind == "name" and self.token == name):
+            self.advance()
+            return True
+        return False
+
+    def value (self):
+        kind  = self.kind
+        token = self.token
+        if (kind == "string" or kind == "number"):
+            self.advance()
+            return token
+        if (kind == "name" and token in kConstants):
+            self.advance()
+            return kConstants[token]
+        if (kind == "op"):
+            if (token == "{"):
+                self.advance()
+                return self.table()
+            if (token == "-"):
+                self.advance()
+                if (self.kind == "number"):
+                    value = -self.token
+                    self.advance()
+                    return value
+        self.fail("a value")
+
+    # The rest of a table constructor after the opening brace.
+    #
+    def table (self):
+        table = LuaTable()
+        append = table.append
+        while (not self.accept("}")):
+            if (self.kind == "name" and self.token not in kConstants):
+                key = self.token
+                self.advance()
+                self.expect("op", "=")
+                append(key, self.value())
+            elif (self.accept("[")):
+                key = self.value()
+                self.expect("op", "]")
+                self.expect("op", "=")
+                append(key, self.value())
+            else:
+                append(None, self.value())
+
+            if (not (self.accept(",") or self.accept(";"))):
+                self.expect("op", "}")
+                break
+        return table
+
+
+###############################################################################
+#
+# Serializer.
+#
+###############################################################################
+
+kLuaKeywords = frozenset((
+    "and", "break", "do", "else", "elseif", "end", "false", "for", "function",
+    "goto", "if", "in", "local", "nil", "not", "or", "repeat", "return", "then",
+    "true", "until", "while",
+))
+
+kNameRe = re.compile(r"[A-Za-z_][A-Za-z0-9_]*\Z")
+
+kQuoteRe = re.compile(r"[\\\"\x00-\x1f\x7f]")
+
+def quote_match (m):
+    c = m.group()
+    if (c in "\\\""):
+        return "\\"+c
+    if (c == "\n"):
+        return "\\n"
+    return "\\%d" % ord(c)
+
+def write_value (value, out):
+    if (isinstance(value, LuaTable)):
+        write_table(value, out)
+    elif (value is True):
+        out.append("true")
+    elif (value is False):
+        out.append("false")
+    elif (value == None):
+        out.append("nil")
+    elif (isinstance(value, str)):
+        out.append("\"")
+        out.append(kQuoteRe.sub(quote_match, value))
+        out.append("\"")
+    elif (isinstance(value, float) and value == int(value) and abs(value) < 1e16):
+        out.append("%d.0" % value)
+    else:
+        out.append(repr(value))
+
+def write_table (table, out):
+    out.append("{")
+    first = True
+    for key, value in table.items:
+        if (not first):
+            out.append(",")
+        first = False
+        if (key != None):
+            if (isinstance(key, str) and kNameRe.match(key) and key not in kLuaKeywords):
+                out.append(key)
+            else:
+                out.append("[")
+                write_value(key, out)
+                out.append("]")
+            out.append("=")
+        write_value(value, out)
+    out.append("}")
+
+def to_lua (value):
+    out = []
+    write_value(value, out)
+    return "".join(out)
+
+
+###############################################################################
+#
+# Config files.
+#
+###############################################################################
+
+kChunkPrefix = "do local _="
+kChunkSuffix = ";return _;end"
+
+# Parse the text of a MIDI2LR config file and return its root table. Plain
+# "return {...}" chunks and bare table constructors are accepted as well.
+#
+def parse_config (text):
+    parser = LuaParser(text)
+
+    if (parser.accept_name("do")):
+        parser.expect("name", "local")
+        parser.expect("name", "_")
+        parser.expect("op", "=")
+        root = parser.value()
+        parser.accept(";")
+        parser.expect("name", "return")
+        parser.expect("name", "_")
+        parser.accept(";")
+        parser.expect("name", "end")
+    else:
+        parser.accept_name("return")
+        root = parser.value()
+        parser.accept(";")
+
+    if (parser.kind != "eof"):
+        parser.fail("end of file")
+    return root
+
+def format_config (root):
+    return kChunkPrefix+to_lua(root)+kChunkSuffix
+
+def load_config (fileName):
+    with open(fileName, encoding="utf-8", newline="") as f:
+        return parse_config(f.read())
+
+def save_config (root, fileName):
+    tmpName = fileName+"."+str(os.getpid())+".tmp"
+    try:
+        with open(tmpName, "w", encoding="utf-8", newline="") as f:
+            f.write(format_config(root))
+        os.replace(tmpName, fileName)
+    except BaseException:
+        if (os.path.exists(tmpName)):
+            os.remove(tmpName)
+        raise
+
+# The preferences table. MIDI2LR wraps it in a one-element array.
+#
+def config_preferences (root):
+    first = root.array()[:1]
+    if (first and isinstance(first[0], LuaTable)):
+        return first[0]
+    return root
+
+def config_section (root, name):
+    prefs = config_preferences(root)
+    section = prefs.get(name)
+    if (section == None):
+        section = LuaTable()
+        prefs.set(name, section)
+    return section
+
+
+###############################################################################
+#
+# Generator.
+#
+###############################################################################
+
+# Rebuild the Profiles map and the ActionSeries strings of a config from the
+# generated profiles, in place.
+#
+# A profile with a series number n gets the profile switch slot "profilen"
+# and ActionSeries n, which runs the profile's actions and then switches to
+# that slot. Every Lightroom module or panel a profile lists in panels is
+# mapped to the profile's XML file.
+#
+# Only those entries are written. Other slots, panels and action series, and
+# every other key of the config, are kept as they are.
+#
+def update_config (root, profiles):
+    profileMap   = config_section(root, "Profiles")
+    actionSeries = config_section(root, "ActionSeries")
+
+    for profile in profiles:
+        fileName = profile.name+".xml"
+        for panel in profile.panels:
+            profileMap.set(panel, fileName)
+
+        if (profile.series > 0):
+            slot = "profile"+str(profile.series)
+            profileMap.set(slot, fileName)
+            actionSeries.set_array(profile.series, " ".join(list(profile.actions)+[slot]))
+
+    return root
+
+
+###############################################################################
+#
+# Consistency index.
+#
+###############################################################################
+
+# Commands that refer to numbered config entries: ActionSeriesN and KeyN run
+# an action series or a keyboard shortcut, profileN switches to a profile slot.
+#
+kReferenceRe = re.compile(r"(ActionSeries|Key|profile)(\d+)\Z")
+
+# A reference that does not resolve.
+# reference The referenced entry, e.g. "ActionSeries9" or "profile3"
+# source    Where the reference is made: a profile name, "ActionSeriesN" or
+#           "Profiles.<key>"
+#
+class Problem:
+    __slots__ = ("reference", "source", "message")
+
+    def __init__ (self, reference, source, message):
+        self.reference = reference
+        self.source    = source
+        self.message   = message
+
+    def to_dict (self):
+        return {"reference": self.reference, "source": self.source, "message": self.message}
+
+    def __str__ (self):
+        return self.source+": "+self.message
+
+# Which profiles use which ActionSeries, Key and profile slot entries of a
+# config, and what those entries hold. Built in one pass over the commands of
+# all profiles and the Profiles, ActionSeries and Keys sections of the config.
+#
+# usage maps each profile name to the commands its XML profile assigns.
+#
+class ConfigIndex:
+    def __init__ (self, root, usage):
+        prefs = config_preferences(root)
+        self.profileMap = prefs.get("Profiles", LuaTable())
+        self.series     = prefs.get("ActionSeries", LuaTable()).array()
+        self.keys       = prefs.get("Keys", LuaTable()).array()
+        self.files      = set()
+        self.users      = {}      # reference -> [profile names]
+
+        for name, commands in usage.items():
+            self.files.add(name+".xml")
+            for command in commands:
+                if (kReferenceRe.match(command)):
+                    users = self.users.setdefault(command, [])
+                    if (not users or users[-1] != name):
+                        users.append(name)
+
+        # The profile slots each action series switches to.
+        self.seriesSlots = {}
+        for n, series in enumerate(self.series, 1):
+            for word in str(series).split():
+                m = kReferenceRe.match(word)
+                if (m and m.group(1) == "profile"):
+                    self.seriesSlots.setdefault("ActionSeries"+str(n), []).append(word)
+
+    # The profiles that use a reference such as "ActionSeries9" or "Key1".
+    #
+    def users_of (self, reference):
+        return list(self.users.get(reference, []))
+
+    # The profileN slots of the Profiles map that hold no profile.
+    #
+    def empty_slots (self):
+        slots = []
+        for key, value in self.profileMap.items:
+            m = kReferenceRe.match(str(key))
+            if (m and m.group(1) == "profile" and value == ""):
+                slots.append(key)
+        return sorted(slots, key=lambda k: int(k[7:]))
+
+    def defines (self, reference):
+        kind, n = kReferenceRe.match(reference).groups()
+        n = int(n)
+        if (kind == "ActionSeries"):
+            return n <= len(self.series) and self.series[n-1] != ""
+        if (kind == "Key"):
+            return (n <= len(self.keys) and isinstance(self.keys[n-1], LuaTable)
+                    and self.keys[n-1].get("key", "") != "")
+        return self.profileMap.get(reference, "") != ""
+
+    # All references that do not resolve: commands using undefined action
+    # series, keys or profile slots, action series switching to empty slots
+    # and Profiles entries naming files that are not generated.
+    #
+    def problems (self):
+        problems = []
+        for reference, users in self.users.items():
+            if (not self.defines(reference)):
+                for name in users:
+                    problems.append(Problem(reference, name, "uses "+reference+", which is not defined in the config"))
+
+        for series, slots in self.seriesSlots.items():
+            for slot in slots:
+                if (not self.defines(slot)):
+                    problems.append(Problem(slot, series, "switches to "+slot+", which holds no profile"))
+
+        for key, value in self.profileMap.items:
+            if (value != "" and value not in self.files):
+                problems.append(Problem(value, "Profiles."+str(key), "selects "+value+", which is not generated"))
+        return problems
+
+
+###############################################################################
+#
+# Main
+#
+###############################################################################
+
+# Print the profile map and action series of a config file.
+#
+def main (argv=None):
+    argv = sys.argv[1:] if argv == None else argv
+    if (len(argv) != 1):
+        print("usage: midi2lr_config.py CONFIG", file=sys.stderr)
+        return 2
+
+    root = load_config(argv[0])
+    prefs = config_preferences(root)
+
+    profileMap = prefs.get("Profiles", LuaTable())
+    for key in sorted(profileMap.keys(), key=str):
+        print("%-24s %s" % (key, profileMap.get(key)))
+
+    for n, series in enumerate(prefs.get("ActionSeries", LuaTable()).array(), 1):
+        print("ActionSeries%-12d %s" % (n, series))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())